@@ -0,0 +1,47 @@
+import os
+import sqlite3
+import threading
+import time
+
+# ==================================================
+# AI回答キャッシュ (プロンプトハッシュ → 回答)
+# ==================================================
+
+DEFAULT_ANSWER_CACHE_PATH = os.path.join(".cache", "answers.sqlite3")
+
+
+class AnswerCache:
+    """同じプロンプトへのDify回答をローカルに保存して再利用する"""
+
+    def __init__(self, path: str = DEFAULT_ANSWER_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " prompt_hash TEXT PRIMARY KEY, race_id TEXT, answer TEXT, created_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT answer FROM answers WHERE prompt_hash = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, race_id: str, answer: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)", (key, race_id, answer, time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def is_cacheable_answer(answer: str, stats: dict) -> bool:
+    """途中でエラーになった回答や空の回答は保存しない
+    (stats は DifyClient.stream の計測値。途中まで受信した回答は末尾にエラー表示が付くため、本文ではなく error で判定)"""
+    return not stats.get("error") and bool(answer.strip())
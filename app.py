@@ -1,17 +1,26 @@
 import time
-import json
-import re
-import requests
 import streamlit as st
 from datetime import datetime
-import pytz
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from bs4 import BeautifulSoup
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
+from zoneinfo import ZoneInfo
+from stream_render import ThrottledRenderer
+from prompt_encoder import PROMPT_FORMATS, DEFAULT_TOKEN_BUDGET
+from places import PLACE_NAMES
+from memory_governor import DEFAULT_MEMORY_LIMIT_MB
+
+# 設定画面の再実行を軽くするため、スクレイピング・AI・DB関連 (selenium, supabase, bs4, pandas) は
+# 分析開始時に各 get_* の中で読み込む (読み込み後はプロセス内で共有され、再実行時の負担はない)
+if TYPE_CHECKING:
+    from supabase import Client
+    from page_cache import PageCache
+    from history_writer import HistoryWriter
+    from answer_cache import AnswerCache
+    from session_manager import SessionManager
+    from speed_store import SpeedStore
+    from race_snapshot import SnapshotStore
+    from checkpoint_store import CheckpointStore
+    from page_archive import PageArchive
+    from card_job import Job, JobManager
 
 # ==================================================
 # 1. 設定・定数・Secrets読み込み
@@ -35,344 +44,195 @@ def check_password():
 
 if not check_password(): st.stop()
 
-# 認証情報の読み込み
-KEIBA_ID = st.secrets.get("KEIBA_ID", "")
-KEIBA_PASS = st.secrets.get("KEIBA_PASS", "")
-NETKEIBA_EMAIL = st.secrets.get("NETKEIBA_EMAIL", "")
-NETKEIBA_PASS = st.secrets.get("NETKEIBA_PASS", "")
-DIFY_API_KEY = st.secrets.get("DIFY_API_KEY", "")
-SUPABASE_URL = st.secrets.get("SUPABASE_URL", "")
-SUPABASE_ANON_KEY = st.secrets.get("SUPABASE_ANON_KEY", "")
-
-# 場所コード変換マップ (競馬ブック -> Netkeiba)
-KB_TO_NK_CODE = {
-    "10": "44", # 大井
-    "11": "45", # 川崎
-    "12": "43", # 船橋
-    "13": "42"  # 浦和
-}
-PLACE_NAMES = {"10": "大井", "11": "川崎", "12": "船橋", "13": "浦和"}
+def load_config():
+    """認証情報・接続先の読み込み (処理本体は race_pipeline.CONFIG を参照)
+    設定画面の再実行では読まず、分析開始時と各クライアントの作成時にだけ読み込む"""
+    import race_pipeline
+    return race_pipeline.configure(st.secrets)
 
 # ==================================================
-# 2. ヘルパー関数 (Supabase, Driver)
+# 2. ヘルパー関数 (Supabase, キャッシュ, 画面表示)
 # ==================================================
 
 @st.cache_resource
-def get_supabase_client() -> Client | None:
-    if not SUPABASE_URL or not SUPABASE_ANON_KEY: return None
-    return create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-
-def save_history(year, place_code, place_name, month, day, race_num_str, race_id, ai_answer):
-    """Supabaseに履歴を保存"""
-    supabase = get_supabase_client()
-    if not supabase: return
-    data = {
-        "year": str(year),
-        "place_code": str(place_code),
-        "place_name": place_name,
-        "day": str(day),
-        "month": str(month),
-        "race_num": race_num_str,
-        "race_id": race_id,
-        "output_text": ai_answer,
-    }
-    try:
-        supabase.table("history").insert(data).execute()
-    except Exception as e:
-        st.error(f"Supabase save error: {e}")
-
-def get_driver():
-    """Seleniumドライバーの起動設定"""
-    options = Options()
-    options.add_argument("--headless") # ヘッドレスモード
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--window-size=1280,1080")
-    # Bot検知回避のためのUser-Agent
-    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-    return webdriver.Chrome(options=options)
+def get_supabase_client() -> "Client | None":
+    from race_pipeline import create_supabase_client
+    load_config()
+    return create_supabase_client()
 
-# ==================================================
-# 3. 競馬ブック スクレイピング関数
-# ==================================================
+@st.cache_resource
+def get_history_writer() -> "HistoryWriter":
+    """履歴書き込みスレッド (プロセス内で共有、起動時に未送信ジャーナルを再送)"""
+    from history_writer import HistoryWriter
+    writer = HistoryWriter(get_supabase_client)
+    writer.replay_journal()
+    return writer
 
-def login_keibabook(driver):
-    if not KEIBA_ID or not KEIBA_PASS:
-        st.warning("⚠️ 競馬ブックのID/PASSが設定されていません。")
-        return False
-    try:
-        driver.get("https://s.keibabook.co.jp/login/login")
-        # 要素が見つかるまで待機
-        WebDriverWait(driver, 10).until(EC.visibility_of_element_located((By.NAME, "login_id"))).send_keys(KEIBA_ID)
-        driver.find_element(By.CSS_SELECTOR, "input[type='password']").send_keys(KEIBA_PASS)
-        driver.find_element(By.CSS_SELECTOR, "input[type='submit']").click()
-        time.sleep(1)
-        return True
-    except Exception as e:
-        st.error(f"競馬ブック ログインエラー: {e}")
-        return False
-
-def fetch_race_ids_from_schedule(driver, year, month, day, target_place_code):
-    """日程ページから対象競馬場の全レースIDを取得"""
-    date_str = f"{year}{month}{day}"
-    url = f"https://s.keibabook.co.jp/chihou/nittei/{date_str}10" # 末尾10は地方トップ固定
-    
-    st.info(f"📅 日程取得中: {url}")
-    driver.get(url)
-    time.sleep(1)
-    
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    race_ids = []
-    seen = set()
-    
-    # リンクからID抽出
-    for a in soup.find_all("a", href=True):
-        href = a['href']
-        match = re.search(r'(\d{16})', href)
-        if match:
-            rid = match.group(1)
-            # IDの6-7文字目(場所コード)が一致するか
-            if rid[6:8] == target_place_code:
-                if rid not in seen:
-                    race_ids.append(rid)
-                    seen.add(rid)
-    race_ids.sort()
-    return race_ids
-
-def parse_race_info(html: str):
-    """レース名・条件などを取得"""
-    soup = BeautifulSoup(html, "html.parser")
-    racetitle = soup.find("div", class_="racetitle")
-    if not racetitle: return {}
-    
-    racemei = racetitle.find("div", class_="racemei")
-    race_name = racemei.find_all("p")[1].get_text(strip=True) if racemei and len(racemei.find_all("p")) >= 2 else ""
-    
-    sub = racetitle.find("div", class_="racetitle_sub")
-    cond = sub.find_all("p")[1].get_text(" ", strip=True) if sub and len(sub.find_all("p")) >= 2 else ""
-    return {"race_name": race_name, "cond": cond}
-
-def parse_danwa_comments(html: str):
-    """談話を取得"""
-    soup = BeautifulSoup(html, "html.parser")
-    danwa_dict = {}
-    table = soup.find("table", class_="danwa")
-    if table and table.tbody:
-        current_uma = None
-        for row in table.tbody.find_all("tr"):
-            uma_td = row.find("td", class_="umaban")
-            if uma_td:
-                current_uma = uma_td.get_text(strip=True)
-                continue
-            txt_td = row.find("td", class_="danwa")
-            if txt_td and current_uma:
-                danwa_dict[current_uma] = txt_td.get_text(strip=True)
-                current_uma = None
-    return danwa_dict
-
-def parse_syutuba_jockey(html: str):
-    """出馬表から騎手・乗り替わり情報を取得"""
-    soup = BeautifulSoup(html, "html.parser")
-    jockey_info = {}
-    table = soup.find("table", class_="syutuba_sp")
-    if not table or not table.find("tbody"): return {}
-
-    for row in table.find("tbody").find_all("tr"):
-        tds = row.find_all("td")
-        if not tds: continue
-        
-        # 1列目が馬番
-        umaban_text = tds[0].get_text(strip=True)
-        if not umaban_text.isdigit(): continue
-        umaban = umaban_text
-        
-        # 騎手情報
-        kisyu_p = row.find("p", class_="kisyu")
-        if kisyu_p and kisyu_p.find("a"):
-            anchor = kisyu_p.find("a")
-            name = anchor.get_text(strip=True)
-            is_change = bool(anchor.find("strong"))
-            jockey_info[umaban] = {"name": name, "is_change": is_change}
-            
-    return jockey_info
-
-def parse_cyokyo(html: str):
-    """調教データを取得"""
-    soup = BeautifulSoup(html, "html.parser")
-    cyokyo_dict = {}
-    tables = soup.find_all("table", class_="cyokyo")
-    for tbl in tables:
-        tbody = tbl.find("tbody")
-        if not tbody: continue
-        rows = tbody.find_all("tr", recursive=False)
-        if not rows: continue
-        
-        h_row = rows[0]
-        uma_td = h_row.find("td", class_="umaban")
-        name_td = h_row.find("td", class_="kbamei")
-        if not uma_td or not name_td: continue
-        
-        umaban = uma_td.get_text(strip=True)
-        bamei = name_td.get_text(" ", strip=True)
-        tanpyo = h_row.find("td", class_="tanpyo").get_text(strip=True) if h_row.find("td", class_="tanpyo") else ""
-        detail = rows[1].get_text(" ", strip=True) if len(rows) > 1 else ""
-        
-        cyokyo_dict[umaban] = f"【馬名】{bamei} 【短評】{tanpyo} 【詳細】{detail}"
-    return cyokyo_dict
+@st.cache_resource
+def get_answer_cache() -> "AnswerCache":
+    from answer_cache import AnswerCache
+    return AnswerCache()
 
-# ==================================================
-# 4. Netkeiba スクレイピング関数 (修正版)
-# ==================================================
+@st.cache_resource
+def get_page_cache() -> "PageCache":
+    """ページキャッシュ (プロセス内で共有)"""
+    from page_cache import PageCache
+    return PageCache()
 
-def login_netkeiba(driver):
-    """Netkeibaにログイン（修正版）"""
-    if not NETKEIBA_EMAIL or not NETKEIBA_PASS:
-        st.warning("⚠️ Netkeibaのログイン情報がありません。")
-        return False
-    try:
-        login_url = "https://regist.netkeiba.com/account/?pid=login"
-        driver.get(login_url)
-        
-        # ページ読み込み待機 (最大10秒)
-        wait = WebDriverWait(driver, 10)
-        
-        # ログインフォームが表示されるか確認
-        if "logout" in driver.page_source:
-            st.info("✅ Netkeiba: 既にログイン済み")
-            return True
-            
-        # ID入力待機
-        login_id_input = wait.until(EC.visibility_of_element_located((By.NAME, "login_id")))
-        login_id_input.clear()
-        login_id_input.send_keys(NETKEIBA_EMAIL)
-        
-        # パスワード入力
-        password_input = driver.find_element(By.NAME, "pswd")
-        password_input.clear()
-        password_input.send_keys(NETKEIBA_PASS)
-        
-        # ★修正ポイント: ボタンを探さず、フォームをsubmitする
-        password_input.submit()
-        
-        time.sleep(2) # 遷移待ち
-        return True
-        
-    except Exception as e:
-        st.error(f"Netkeiba ログインエラー: {e}")
-        return False
-
-def get_netkeiba_speed_url(year, month, day, kb_place_code, race_num):
-    """Netkeibaのタイム指数URL生成"""
-    nk_place = KB_TO_NK_CODE.get(kb_place_code)
-    if not nk_place: return None
-    date_str = f"{month.zfill(2)}{day.zfill(2)}"
-    race_str = str(race_num).zfill(2)
-    # ID構成: YYYY + NK場所コード + MMDD + RR
-    race_id = f"{year}{nk_place}{date_str}{race_str}"
-    return f"https://nar.netkeiba.com/race/speed.html?race_id={race_id}&type=shutuba&mode=past"
-
-def scrape_netkeiba_speed_index(driver, url, current_place_name):
-    """タイム指数ページからデータを取得"""
-    data = {}
-    try:
-        driver.get(url)
-        time.sleep(1)
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        
-        # 現在のレース条件 (例: "大井ダ1400")
-        current_condition = ""
-        race_data_div = soup.find("div", class_="RaceData01")
-        if race_data_div:
-            text = race_data_div.get_text()
-            dist_match = re.search(r'(\d{3,4})m', text)
-            if dist_match:
-                track_type = "芝" if "芝" in text else "ダ"
-                current_condition = f"{current_place_name}{track_type}{dist_match.group(1)}"
-        
-        table = soup.find("table", class_="SpeedIndex_Table")
-        if not table: return {}
-        
-        rows = table.find_all("tr", class_="HorseList")
-        for row in rows:
-            try:
-                # 馬番
-                umaban_td = row.find("td", class_=re.compile("umaban", re.I))
-                if not umaban_td: continue
-                umaban = umaban_td.get_text(strip=True)
-                
-                # 指数データの開始列特定
-                cols = row.find_all("td")
-                start_idx = -1
-                for i, col in enumerate(cols):
-                    if "Horse_Name" in " ".join(col.get("class", [])):
-                        start_idx = i + 1
-                        break
-                if start_idx == -1: continue
-                
-                # 近5走データ取得 (start_idx+1 から 5つ分)
-                target_cols = cols[start_idx+1 : start_idx+6]
-                past_list = []
-                speed_match_list = []
-                
-                for td in target_cols:
-                    course_span = td.find("span")
-                    if not course_span: continue
-                    course_str = course_span.get_text(strip=True)
-                    
-                    idx_a = td.find("a")
-                    idx_val = idx_a.get_text(strip=True) if idx_a else "-"
-                    
-                    if idx_val.isdigit():
-                        past_list.append(f"{course_str}({idx_val})")
-                        # 同条件判定 (部分一致)
-                        if current_condition and current_condition in course_str:
-                            speed_match_list.append(idx_val)
-                            
-                data[umaban] = {
-                    "past": " / ".join(past_list) if past_list else "なし",
-                    "speed_index": ", ".join(speed_match_list) if speed_match_list else "該当なし",
-                    "condition": current_condition
-                }
-            except: continue
-            
-        return data
-    except Exception as e:
-        return {} # エラー時は空データを返す
+@st.cache_resource
+def get_speed_store() -> "SpeedStore":
+    """近走タイム指数の蓄積先 (プロセス内で共有)"""
+    from speed_store import SpeedStore
+    return SpeedStore()
 
-# ==================================================
-# 5. Dify API連携 (ストリーミング)
-# ==================================================
+@st.cache_resource
+def get_snapshot_store() -> "SnapshotStore":
+    """レースごとの取得データの指紋 (リフレッシュ時の変更検知用)"""
+    from race_snapshot import SnapshotStore
+    return SnapshotStore()
+
+@st.cache_resource
+def get_checkpoint_store() -> "CheckpointStore":
+    """レースごとの途中経過 (中断した分析の再開用)"""
+    from checkpoint_store import CheckpointStore
+    return CheckpointStore()
+
+@st.cache_resource
+def get_page_archive() -> "PageArchive":
+    """取得ページの日別アーカイブ (replay.py でのバックテスト用、合計 ARCHIVE_MAX_MB を超えたら古い日から削除)"""
+    from page_archive import DEFAULT_ARCHIVE_MAX_MB, PageArchive
+    return PageArchive(max_bytes=int(float(st.secrets.get("ARCHIVE_MAX_MB", DEFAULT_ARCHIVE_MAX_MB)) * 1024 * 1024))
+
+@st.cache_resource
+def get_session_manager(keep_browser: bool, lean: bool = True) -> "SessionManager":
+    """ログイン済みCookie(とブラウザ)を再実行・セッション間で共有"""
+    from session_manager import SessionManager
+    from race_pipeline import get_driver, site_logins
+    load_config()
+    return SessionManager(lambda: get_driver(lean), site_logins(), keep_browser=keep_browser, lean=lean)
 
-def stream_dify_workflow(full_text: str):
-    if not DIFY_API_KEY:
-        yield "⚠️ DIFY_API_KEY未設定"
-        return
-    
-    payload = {"inputs": {"text": full_text}, "response_mode": "streaming", "user": "keiba-bot"}
-    headers = {"Authorization": f"Bearer {DIFY_API_KEY}", "Content-Type": "application/json"}
-    
-    try:
-        res = requests.post("https://api.dify.ai/v1/workflows/run", headers=headers, json=payload, stream=True, timeout=300)
-        for line in res.iter_lines():
-            if line:
-                decoded = line.decode('utf-8')
-                if decoded.startswith("data:"):
-                    try:
-                        data = json.loads(decoded.replace("data: ", ""))
-                        if "answer" in data:
-                            yield data.get("answer", "")
-                    except: pass
-    except Exception as e:
-        yield f"⚠️ API Error: {str(e)}"
+
+@st.cache_resource
+def get_job_manager() -> "JobManager":
+    """分析ジョブの実行管理 (全セッションで共有、同時実行数は MAX_CONCURRENT_JOBS)"""
+    from card_job import JobManager
+    return JobManager(int(st.secrets.get("MAX_CONCURRENT_JOBS", 1)))
+
+def render_job(job: "Job"):
+    """ジョブの進捗を完了まで表示 (ワーカースレッドの更新を待って差分だけ描画)"""
+    p = job.params
+    queue_area = st.empty()
+    message_area = st.container()
+    race_area = st.container()
+    shown_messages = 0
+    areas, renderers, shown = {}, {}, {}
+    version = -1
+    while True:
+        version = job.wait(version, 0.2)
+        position = get_job_manager().position(job)
+        if position:
+            queue_area.info(f"⏳ 実行待ち ({position} 番目、同時実行 {get_job_manager().max_running} 件まで)")
+        else:
+            queue_area.empty()
+        state, messages, races = job.view()
+        with message_area:
+            for level, text in messages[shown_messages:]:
+                getattr(st, level)(text)
+        shown_messages = len(messages)
+
+        for race_id, race in races.items():
+            if race_id not in areas:
+                with race_area.container():
+                    st.markdown(f"### {race['title']}")
+                    areas[race_id] = (st.empty(), st.empty(), st.empty())
+                    st.divider()
+            status_area, note_area, result_area = areas[race_id]
+            if shown.get((race_id, "status")) != race["status"]:
+                getattr(status_area, race["status"][0])(race["status"][1])
+            view = (race["note"], race["changes"] is not None and len(race["changes"]))
+            if shown.get((race_id, "note")) != view:
+                if race["changes"]:
+                    with note_area.container():
+                        if race["note"]: getattr(st, race["note"][0])(race["note"][1])
+                        st.caption(f"🔁 前回から {len(race['changes'])} 件の変更")
+                        st.dataframe(race["changes"], hide_index=True)
+                elif race["note"]:
+                    getattr(note_area, race["note"][0])(race["note"][1])
+                elif race["changes"] is not None:
+                    note_area.caption("変更なし")
+            shown[(race_id, "status")], shown[(race_id, "note")] = race["status"], view
+
+            # 回答はストリーミング中は間引いて描画し、終わったら確定描画
+            text = race["text"]
+            renderer = renderers.setdefault(race_id, ThrottledRenderer(result_area))
+            renderer.write(text[len(renderer.text()):])
+            renderer.flush_if_due()
+            if not race["streaming"] and text and shown.get((race_id, "text")) != len(text):
+                renderer.close()
+                shown[(race_id, "text")] = len(text)
+        if state == "done": break
+
+    if job.error:
+        st.error(f"エラー発生: {job.error}")
+    # 履歴はバックグラウンドで送信するため、このジョブの分の結果が出るまで少し待つ
+    deadline = time.monotonic() + 10
+    while job.saves["pending"] and time.monotonic() < deadline:
+        version = job.wait(version, 0.5)
+    saves = dict(job.saves)
+    if saves["error"]:
+        st.error(f"Supabase save error: {saves['error']}")
+    if saves["journaled"]:
+        st.warning(f"⚠️ Supabaseに保存できなかった履歴 {saves['journaled']} 件をローカルに退避しました (次回起動時に再送)")
+    if saves["pending"]:
+        st.info(f"履歴 {saves['pending']} 件をバックグラウンドで保存中です")
+    writer = get_history_writer()
+
+    with st.expander("📊 パフォーマンス (ステージ別所要時間)"):
+        render_perf_panel(job.timeline, f"{p.target_date:%Y%m%d}_{p.place_code}")
+        st.caption(f"Supabase upsert 平均 {writer.avg_upsert_seconds():.2f} 秒 (バックグラウンド)")
+
+    if job.memory is not None:
+        with st.expander("🧠 メモリ使用量 (レースごとのピーク、MB)"):
+            st.dataframe(job.memory.race_peaks(), hide_index=True)
+            st.caption(f"全体のピーク {job.memory.peak_mb:.0f} MB (上限 {job.memory.limit_mb:.0f} MB)"
+                       f" / ブラウザ破棄 {job.memory.recycles} 回")
+
+    with st.expander("⏱ ページ待機ログ"):
+        if job.cache_stats:
+            stats = job.cache_stats
+            st.caption(f"キャッシュ: ヒット {stats['hits']} / 再検証 {stats['revalidated']} / 取得 {stats['misses']}"
+                       f" (キャッシュ全体 {get_page_cache().total_bytes() / 1024 / 1024:.1f} MB)")
+        st.dataframe(job.waiter.records)
+        if job.page_stats:
+            st.caption("ブラウザ通信量 (ログイン時)")
+            st.dataframe(job.page_stats)
+
+def render_perf_panel(timeline, file_stem):
+    """ステージ別の所要時間 (レースごとのウォーターフォールと合計) を表示"""
+    import altair as alt
+    import pandas as pd
+
+    df = pd.DataFrame(timeline.spans)
+    if df.empty: return
+    df["label"] = df["race"].map(lambda r: f"{int(r)}R" if pd.notna(r) else "共通")
+    chart = alt.Chart(df).mark_bar().encode(
+        x=alt.X("start:Q", title="経過秒"), x2="end:Q",
+        y=alt.Y("label:N", sort=None, title=None),
+        color="stage:N",
+        tooltip=["stage", "label", "seconds", "thread"],
+    )
+    st.altair_chart(chart, width="stretch")
+    totals = pd.DataFrame(sorted(timeline.totals().items(), key=lambda x: -x[1]), columns=["stage", "seconds"])
+    st.dataframe(totals, hide_index=True)
+    st.download_button("📥 JSON Linesで保存", timeline.to_jsonl(), file_name=f"timings_{file_stem}.jsonl",
+                       mime="application/x-ndjson")
 
 # ==================================================
-# 6. メイン画面・実行ロジック
+# 7. メイン画面・実行ロジック
 # ==================================================
 
 st.title("🏇 南関×ブック×NK 統合分析Bot")
-jst = pytz.timezone('Asia/Tokyo')
-now = datetime.now(jst)
+now = datetime.now(ZoneInfo("Asia/Tokyo"))
 
 # 設定UI
 with st.container():
@@ -394,125 +254,61 @@ with st.container():
     else:
         target_races = list(range(1, 13))
 
-# 実行ボタン
-if st.button("🚀 分析開始", type="primary"):
-    # 日付文字列の準備
-    date_str = target_date.strftime("%Y%m%d")
-    year_str = target_date.strftime("%Y")
-    month_str = target_date.strftime("%m")
-    day_str = target_date.strftime("%d")
-    place_name = PLACE_NAMES.get(PLACE_CODE, "不明")
-
-    driver = get_driver()
-    
-    try:
-        st.info("🔑 各サイトへログイン中...")
-        login_keibabook(driver)
-        
-        # Netkeibaログイン (タイム指数用)
-        if login_netkeiba(driver):
-            st.success("✅ Netkeibaログイン成功")
-        else:
-            st.warning("⚠️ Netkeibaログイン失敗 (タイム指数は取得できない可能性があります)")
-
-        st.info("📡 レースIDを取得中...")
-        race_ids = fetch_race_ids_from_schedule(driver, year_str, month_str, day_str, PLACE_CODE)
-        
-        if not race_ids:
-            st.error("レース情報が見つかりませんでした。")
-        else:
-            # 取得したIDごとにループ
-            for race_id in race_ids:
-                race_num = int(race_id[10:12]) # IDの11,12桁目がレース番号
-                if target_races and race_num not in target_races:
-                    continue
-                
-                st.markdown(f"### {place_name} {race_num}R")
-                status_area = st.empty()
-                result_area = st.empty()
-                
-                try:
-                    status_area.info("📚 データを収集中...")
-                    
-                    # A. 競馬ブック情報 (談話・騎手・調教)
-                    driver.get(f"https://s.keibabook.co.jp/chihou/danwa/1/{race_id}")
-                    html_danwa = driver.page_source
-                    race_meta = parse_race_info(html_danwa)
-                    danwa_dict = parse_danwa_comments(html_danwa)
-                    
-                    driver.get(f"https://s.keibabook.co.jp/chihou/syutuba/{race_id}")
-                    jockey_dict = parse_syutuba_jockey(driver.page_source)
-                    
-                    driver.get(f"https://s.keibabook.co.jp/chihou/cyokyo/1/{race_id}")
-                    cyokyo_dict = parse_cyokyo(driver.page_source)
-                    
-                    # B. Netkeiba情報 (タイム指数)
-                    nk_url = get_netkeiba_speed_url(year_str, month_str, day_str, PLACE_CODE, race_num)
-                    nk_data = {}
-                    if nk_url:
-                        nk_data = scrape_netkeiba_speed_index(driver, nk_url, place_name)
-                    
-                    # C. データ結合
-                    merged_text = []
-                    # 全馬番のリスト作成
-                    all_uma = sorted(list(set(list(jockey_dict.keys()) + list(nk_data.keys()))), 
-                                     key=lambda x: int(x) if x.isdigit() else 999)
-                    
-                    for uma in all_uma:
-                        j = jockey_dict.get(uma, {"name": "不明", "is_change": False})
-                        d = danwa_dict.get(uma, "（なし）")
-                        c = cyokyo_dict.get(uma, "（なし）")
-                        nk = nk_data.get(uma, {})
-                        
-                        speed_idx = nk.get("speed_index", "なし")
-                        condition = nk.get("condition", "不明")
-                        
-                        # スピード指数の強調表示
-                        speed_txt = ""
-                        if speed_idx != "なし" and speed_idx != "該当なし":
-                            speed_txt = f"★【絶対スピード指数(同条件:{condition})】: {speed_idx}"
-                        
-                        alert = "【⚠️乗り替わり】" if j["is_change"] else ""
-                        
-                        line = (
-                            f"▼[馬番{uma}] {j['name']} {alert}\n"
-                            f" {speed_txt}\n"
-                            f" 近5走指数: {nk.get('past', '-')}\n"
-                            f" 談話: {d}\n"
-                            f" 調教: {c}"
-                        )
-                        merged_text.append(line)
-
-                    if not merged_text:
-                        status_area.warning("データが取得できませんでした。スキップします。")
-                        continue
-
-                    # D. プロンプト作成
-                    prompt = (
-                        f"レース名: {race_meta.get('race_name','')}\n"
-                        f"条件: {race_meta.get('cond','')}\n\n"
-                        "以下の各馬のデータ（騎手、タイム指数、談話、調教）から、推奨馬を分析してください。\n"
-                        "特に「絶対スピード指数」が高い馬、および「乗り替わり」の有無を重視すること。\n\n"
-                        + "\n".join(merged_text)
-                    )
-                    
-                    # E. AI分析 (ストリーミング表示)
-                    status_area.info("🤖 AI分析を実行中...")
-                    full_ans = ""
-                    for chunk in stream_dify_workflow(prompt):
-                        full_ans += chunk
-                        result_area.markdown(full_ans + "▌")
-                    
-                    result_area.markdown(full_ans)
-                    status_area.success("分析完了")
-                    
-                    # F. 保存
-                    save_history(year_str, PLACE_CODE, place_name, month_str, day_str, f"{race_num:02}", race_id, full_ans)
-                    
-                except Exception as e:
-                    status_area.error(f"エラー発生: {e}")
-                
-                st.divider()
-
-    finally:
-        driver.quit()
+    # 並列取得設定 (ワーカー数1で従来どおりの逐次取得)
+    with st.expander("⚙️ 並列実行設定"):
+        p1, p2 = st.columns(2)
+        with p1: MAX_WORKERS = st.number_input("同時取得レース数", min_value=1, max_value=8, value=4)
+        with p2: MAX_PER_HOST = st.number_input("同一サイトへの同時接続数", min_value=1, max_value=6, value=2)
+        PREFETCH_DEPTH = st.number_input("取得済みでAI分析待ちにしておくレース数の上限", min_value=0, max_value=12, value=2)
+        USE_ANSWER_CACHE = st.checkbox("入力が前回と同じレースは保存済みのAI回答を表示する", value=True)
+        KEEP_BROWSER = st.checkbox("ログイン用ブラウザを常駐させる (メモリを多く使用)", value=False)
+        LEAN_BROWSER = st.checkbox("ブラウザで画像・フォント・CSS・広告を読み込まない (軽量モード)", value=True)
+        FORCE_RACES = st.multiselect("AIを強制再分析するレース", list(range(1, 13)), format_func=lambda x: f"{x}R")
+        USE_CACHE = st.checkbox("ページキャッシュを使用する (再実行を高速化)", value=True)
+        f1, f2 = st.columns(2)
+        with f1: PROMPT_FORMAT = st.selectbox("プロンプト形式", PROMPT_FORMATS, format_func=lambda x: {
+            "compact": "コンパクト (表形式)", "verbose": "従来形式", "ab": "A/B比較 (レースごとに振り分け)"}[x])
+        with f2: TOKEN_BUDGET = st.number_input("1レースの入力トークン上限 (コンパクト形式)", min_value=300,
+                                                max_value=8000, value=DEFAULT_TOKEN_BUDGET, step=100)
+        if PROMPT_FORMAT == "ab":
+            st.caption("A/B比較時は形式を history.prompt_format 列に保存します (列が必要)")
+        MEMORY_LIMIT = st.number_input("メモリ上限 (MB、超えたら常駐ブラウザを破棄)", min_value=300, max_value=16000,
+                                       value=DEFAULT_MEMORY_LIMIT_MB, step=100)
+        ARCHIVE_PAGES = st.checkbox("取得したページをアーカイブする (replay.py でのバックテスト用)", value=True)
+        SAVE_TIMINGS = st.checkbox("処理時間の計測結果を履歴に保存する (history.timings 列が必要)", value=False)
+        if st.button("🗑 キャッシュを削除"):
+            get_page_cache().clear()
+            st.toast("キャッシュを削除しました")
+
+# 実行ボタン (リフレッシュ: 談話・出馬表だけ再取得し、前回から変わったレースだけ再分析)
+b1, b2, b3 = st.columns(3)
+with b1: run_clicked = st.button("🚀 分析開始", type="primary")
+with b2: refresh_clicked = st.button("🔄 変更分のみ再分析", help="乗り替わり・取消・談話の更新があったレースだけAI分析をやり直します")
+with b3: resume_clicked = st.button("⏯ 中断したところから再開", help="分析済みのレースは前回の結果を表示し、未完了のレースから続けます")
+if run_clicked or refresh_clicked or resume_clicked:
+    # 同じ条件の分析が他の画面で実行中・待機中なら、新たに実行せずその結果を表示する
+    from card_job import CardParams, CardResources, run_card
+    load_config()
+    params = CardParams(target_date, PLACE_CODE, () if all_races else tuple(target_races), refresh_clicked,
+                        tuple(FORCE_RACES), USE_ANSWER_CACHE, PROMPT_FORMAT, int(TOKEN_BUDGET), resume_clicked,
+                        int(MAX_WORKERS), int(MAX_PER_HOST), int(PREFETCH_DEPTH), USE_CACHE, SAVE_TIMINGS,
+                        int(MEMORY_LIMIT), ARCHIVE_PAGES)
+    resources = CardResources(get_session_manager(KEEP_BROWSER, LEAN_BROWSER), get_page_cache(), get_answer_cache(),
+                              get_supabase_client(), get_history_writer(), get_speed_store(), get_snapshot_store(),
+                              get_checkpoint_store(), get_page_archive())
+    job, created = get_job_manager().submit(params, lambda j: run_card(j, resources))
+    st.session_state["card_job"] = job
+    if not created:
+        st.info("👥 同じ条件の分析が他の画面で実行中のため、その結果を表示します")
+
+# 実行中・直近のジョブを表示 (画面を再読み込みしても途中から表示を再開)
+job = st.session_state.get("card_job")
+if job is not None:
+    render_job(job)
+
+# 蓄積済みのタイム指数履歴 (再取得せずに参照)
+with st.expander("🐎 馬のタイム指数履歴"):
+    horse_name = st.text_input("馬名")
+    if horse_name:
+        st.dataframe(get_speed_store().history(horse_name.strip(), ("run_date", "course", "speed_index", "race_id")),
+                     hide_index=True)
@@ -0,0 +1,240 @@
+"""オフラインE2Eベンチマーク: スタンドインサーバーに対して app.py を AppTest でヘッドレス実行する
+
+    python bench/run_bench.py --races 12 --runs 2 --workers 4 --prefetch 2
+    python bench/run_bench.py --cache --answer-cache --json bench_result.json
+
+レースごと (最初のページ取得開始 → AI回答完了) と開催全体の経過時間・CPU時間・ピークRSSを出力する。
+レースごとのCPU時間はアプリのタイムライン (取得・解析・AI受信などのスパンでそのスレッドが使った時間の合計)、
+ピークRSSはメモリ監視がそのレースの処理中に計測した最大値 (並行処理中のレースとは共有) から取る。
+"""
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(os.path.dirname(HERE), "app.py")
+sys.path.insert(0, HERE)
+
+import standin_server  # noqa: E402
+
+
+class RssSampler(threading.Thread):
+    """実行中のRSSを一定間隔でサンプリングしてピークを記録"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._halt = threading.Event()
+
+    def run(self):
+        page = os.sysconf("SC_PAGE_SIZE")
+        while not self._halt.is_set():
+            with open("/proc/self/statm") as f:
+                rss = int(f.read().split()[1]) * page / 1024 / 1024
+            self.peak_mb = max(self.peak_mb, rss)
+            self._halt.wait(self.interval)
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+def start_server(args):
+    server_args = standin_server.build_parser().parse_args([
+        "--port", str(args.port), "--page-kb", str(args.page_kb), "--page-latency", str(args.page_latency),
+        "--ttft", str(args.ttft), "--token-rate", str(args.token_rate), "--answer-tokens", str(args.answer_tokens),
+    ] + (["--fixtures", args.fixtures] if args.fixtures else []))
+    proc = multiprocessing.Process(target=standin_server.serve, args=(server_args,), daemon=True)
+    proc.start()
+    base = f"http://127.0.0.1:{args.port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{base}/", timeout=1)
+            return proc, base
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("stand-in server did not start")
+
+
+def server_call(base, path, method="GET"):
+    req = urllib.request.Request(f"{base}{path}", method=method)
+    with urllib.request.urlopen(req, timeout=5) as res:
+        body = res.read()
+    return json.loads(body) if body else None
+
+
+def check_speed_order(base):
+    """タイム指数ページの近走が run_no=0 (前走) から日付の新しい順に並ぶことを確認 (近走加重の前提)"""
+    sys.path.insert(0, os.path.dirname(HERE))
+    from parsers import parse_speed_index
+
+    with urllib.request.urlopen(f"{base}/race/speed.html?race_id=202544120101", timeout=5) as res:
+        html = res.read().decode("euc-jp")
+    for uma, info in parse_speed_index(html, "大井").items():
+        runs = sorted(info["runs"], key=lambda run: run["run_no"])
+        expected = [f"{standin_server.run_date(run['run_no']):%Y-%m-%d}" for run in runs]
+        if [run["run_date"] for run in runs] != expected:
+            raise RuntimeError(f"近走の並びが不正です (馬番{uma}): {runs}")
+
+
+def make_app(args, base):
+    from streamlit.testing.v1 import AppTest
+
+    # AppTest実行時の「missing ScriptRunContext」警告を抑制
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    secrets = {
+        "KEIBABOOK_URL": base, "NETKEIBA_NAR_URL": base, "NETKEIBA_REGIST_URL": base,
+        "DIFY_API_URL": f"{base}/v1", "DIFY_API_KEY": "bench",
+        "SUPABASE_URL": base, "SUPABASE_ANON_KEY": "bench.bench.bench",
+    }
+    if args.with_login:
+        secrets.update({"KEIBA_ID": "bench", "KEIBA_PASS": "bench",
+                        "NETKEIBA_EMAIL": "bench@example.com", "NETKEIBA_PASS": "bench"})
+    for k, v in secrets.items():
+        at.secrets[k] = v
+    at.session_state["password_correct"] = True
+    return at
+
+
+def configure(at, args):
+    """設定UIをベンチマーク条件に合わせる"""
+    at.date_input[0].set_value(args.date)
+    at.selectbox[0].set_value(args.place)
+    if args.races < 12:
+        [c for c in at.checkbox if c.label == "全レースを一括分析する"][0].uncheck()
+        at.run()
+        for i in range(1, args.races + 1):
+            at.checkbox(key=f"r{i}").check()
+    numbers = {"同時取得レース数": args.workers, "同一サイトへの同時接続数": args.per_host,
+               "取得済みでAI分析待ちにしておくレース数の上限": args.prefetch}
+    for n in at.number_input:
+        if n.label in numbers: n.set_value(numbers[n.label])
+    checks = {"ページキャッシュを使用する (再実行を高速化)": args.cache,
+              "入力が前回と同じレースは保存済みのAI回答を表示する": args.answer_cache}
+    for c in at.checkbox:
+        if c.label in checks: c.set_value(checks[c.label])
+
+
+def run_card(args, base):
+    at = make_app(args, base)
+    at.run()
+    configure(at, args)
+    at.run()
+    server_call(base, "/__bench/reset", "POST")
+
+    sampler = RssSampler()
+    sampler.start()
+    cpu0, t0 = time.process_time(), time.time()
+    [b for b in at.button if b.label == "🚀 分析開始"][0].click()
+    at.run()
+    wall, cpu = time.time() - t0, time.process_time() - cpu0
+    sampler.stop()
+
+    errors = [e.value for e in at.error] + [e.body for e in at.exception]
+    log = server_call(base, "/__bench/log")["log"]
+    job = at.session_state["card_job"] if "card_job" in at.session_state else None
+    return {
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "peak_rss_mb": round(sampler.peak_mb, 1),
+        "max_rss_mb_lifetime": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "races": per_race(log, t0, job),
+        "errors": errors,
+    }
+
+
+def per_race(log, t0, job=None):
+    """サーバーログからレースごとの取得時間とAI時間を集計 (AI呼び出しはレース順に行われる)
+    job があれば、そのタイムラインとメモリ監視からレースごとのCPU時間・ピークRSSを付ける"""
+    cpu = job.timeline.cpu_by_race() if job else {}
+    pages = {}
+    for e in log:
+        if e["kind"] in ("danwa", "syutuba", "cyokyo", "speed"):
+            p = pages.setdefault(e["key"], {"start": e["start"], "end": e["end"], "bytes": 0})
+            p["start"] = min(p["start"], e["start"])
+            p["end"] = max(p["end"], e["end"])
+            p["bytes"] += e["bytes"]
+    difys = sorted((e for e in log if e["kind"] == "dify"), key=lambda e: e["key"])
+    races = []
+    for i, key in enumerate(sorted(pages)):
+        p = pages[key]
+        race_num = int(key.split("-")[1])
+        d = difys[i] if i < len(difys) else None
+        end = d["end"] if d else p["end"]
+        races.append({
+            "race": key,
+            "fetch_s": round(p["end"] - p["start"], 3),
+            "ai_s": round(d["end"] - d["start"], 3) if d else None,
+            "wall_s": round(end - p["start"], 3),
+            "done_at_s": round(end - t0, 3),
+            "page_kb": round(p["bytes"] / 1024, 1),
+            "cpu_s": cpu.get(race_num),
+            "peak_rss_mb": round(job.memory.peak_of(race_num), 1) if job else None,
+        })
+    return races
+
+
+def print_report(results):
+    for n, r in enumerate(results, 1):
+        print(f"\n=== run {n}: wall {r['wall_s']:.2f}s / cpu {r['cpu_s']:.2f}s / peak RSS {r['peak_rss_mb']:.0f} MB ===")
+        print(f"{'race':>6} {'fetch_s':>8} {'ai_s':>7} {'wall_s':>7} {'done_at':>8} {'page_kb':>8} {'cpu_s':>7} {'rss_mb':>7}")
+        for x in r["races"]:
+            ai = f"{x['ai_s']:.2f}" if x["ai_s"] is not None else "-"
+            cpu = f"{x['cpu_s']:.2f}" if x["cpu_s"] is not None else "-"
+            rss = f"{x['peak_rss_mb']:.0f}" if x["peak_rss_mb"] else "-"
+            print(f"{x['race']:>6} {x['fetch_s']:>8.2f} {ai:>7} {x['wall_s']:>7.2f} {x['done_at_s']:>8.2f} {x['page_kb']:>8.0f}"
+                  f" {cpu:>7} {rss:>7}")
+        for e in r["errors"]:
+            print(f"  ! {e}")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--fixtures", default=None, help="録画済みページのディレクトリ")
+    p.add_argument("--date", type=datetime.date.fromisoformat, default=datetime.date(2025, 12, 26))
+    p.add_argument("--place", default="10", choices=["10", "11", "12", "13"])
+    p.add_argument("--races", type=int, default=12, help="1Rから何レース分析するか")
+    p.add_argument("--runs", type=int, default=1)
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--per-host", type=int, default=2)
+    p.add_argument("--prefetch", type=int, default=2)
+    p.add_argument("--cache", action="store_true", help="ページキャッシュを有効にする")
+    p.add_argument("--answer-cache", action="store_true", help="AI回答キャッシュを有効にする")
+    p.add_argument("--with-login", action="store_true", help="Chromeでのログインも計測する (chromium必須)")
+    p.add_argument("--page-kb", type=float, default=80)
+    p.add_argument("--page-latency", type=float, default=0.15)
+    p.add_argument("--ttft", type=float, default=1.5)
+    p.add_argument("--token-rate", type=float, default=40)
+    p.add_argument("--answer-tokens", type=int, default=120)
+    p.add_argument("--timeout", type=float, default=900, help="1開催あたりの最大秒数")
+    p.add_argument("--workdir", default=None, help="キャッシュ等の作業ディレクトリ (既定は一時ディレクトリ)")
+    p.add_argument("--json", default=None, help="結果をJSONで保存するパス")
+    args = p.parse_args()
+
+    proc, base = start_server(args)
+    check_speed_order(base)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="nar-bench-"))
+    try:
+        results = [run_card(args, base) for _ in range(args.runs)]
+    finally:
+        proc.terminate()
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: str(v) for k, v in vars(args).items()}, "runs": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""競馬ブック・netkeiba・Dify・Supabase のローカルスタンドインサーバー (ベンチマーク用)
+
+    python bench/standin_server.py --port 8765 --token-rate 40
+
+フィクスチャディレクトリ (--fixtures) に schedule.html / danwa.html / syutuba.html /
+cyokyo.html / speed.html を置くと、生成ページの代わりに録画済みページを返す。
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PLACES = {"10": "大井", "11": "川崎", "12": "船橋", "13": "浦和"}
+NK_TO_KB_CODE = {"44": "10", "45": "11", "43": "12", "42": "13"}
+JOCKEYS = ["森泰斗", "御神本訓史", "笹川翼", "矢野貴之", "本田正重", "和田譲治", "山崎誠士", "町田直希",
+           "吉原寛人", "張田昂", "達城龍次", "野畑凌", "藤本現暉", "岡村健司", "西啓太", "安藤洋一"]
+DANWA_PARTS = ["前走は展開が向かなかった。", "状態は引き続き良好です。", "この距離は合っていると思う。",
+               "ゲートが課題だが今回は練習を積んだ。", "相手関係は楽になった印象。", "叩いて上積みがある。",
+               "馬体重が戻ってきた。", "内枠なら積極的に運びたい。", "時計勝負になれば。"]
+TANPYO = ["動き上々", "平凡", "気配良", "軽快", "もう一息", "伸び脚確か", "活気あり"]
+LAST_RUN_DATE = datetime.date(2025, 12, 1)
+SURFACE_DISTANCES = ["ダ1200", "ダ1400", "ダ1500", "ダ1600", "ダ1700", "ダ1800", "ダ2000", "ダ900"]
+
+
+class BenchState:
+    """リクエストログ・設定を保持 (/__bench/log で取得)"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.log = []
+        self.dify_calls = 0
+
+    def record(self, kind, key, start, end, size=0):
+        with self.lock:
+            self.log.append({"kind": kind, "key": key, "start": start, "end": end, "bytes": size})
+
+
+# ==================================================
+# フィクスチャ生成
+# ==================================================
+
+def _rng(*key):
+    return random.Random("-".join(map(str, key)))
+
+def _filler(kb):
+    """実ページ相当のサイズにするためのナビ・広告・スクリプト"""
+    block = ('<div class="ad_banner"><a href="/ad"><img src="/img/ad.png" alt="広告"></a></div>'
+             '<ul class="gnav"><li><a href="/">トップ</a></li><li><a href="/news">ニュース</a></li></ul>'
+             '<script>window.dataLayer=window.dataLayer||[];dataLayer.push({"event":"pv"});</script>\n')
+    return block * max(0, int(kb * 1024 / len(block.encode())))
+
+def _page(body, kb, charset="UTF-8"):
+    return (f'<!DOCTYPE html><html><head><meta charset="{charset}"><title>bench</title></head>'
+            f'<body><a href="/login/logout">logout</a>{_filler(kb / 2)}{body}{_filler(kb / 2)}</body></html>')
+
+def horse_count(place, rr):
+    return 8 + _rng("n", place, rr).randint(0, 6)
+
+def schedule_page(date, kb):
+    links = []
+    for place in PLACES:
+        for rr in range(1, 13):
+            rid = f"{date[:4]}00{place}00{rr:02d}{date[4:8]}"
+            post = f"{14 + rr // 3}:{rr % 3 * 20:02d}"
+            links.append(f'<li><a href="/chihou/syutuba/{rid}">{PLACES[place]}{rr}R {post}</a></li>')
+    return _page(f'<ul class="nittei">{"".join(links)}</ul>', kb)
+
+def danwa_page(place, rr, kb):
+    rows = []
+    for n in range(1, horse_count(place, rr) + 1):
+        r = _rng("danwa", place, rr, n)
+        comment = "".join(r.sample(DANWA_PARTS, 3))
+        rows.append(f'<tr><td class="umaban">{n}</td><td class="bamei">ベンチホース{n}</td></tr>'
+                    f'<tr><td class="danwa" colspan="2">（調教師）{comment}</td></tr>')
+    title = (f'<div class="racetitle"><div class="racemei"><p>{rr}R</p><p>{PLACES[place]}ベンチ特別{rr}R</p></div>'
+             f'<div class="racetitle_sub"><p>発走 {14 + rr // 3}:{rr % 3 * 20:02d}</p><p>ダ 1400m 3歳以上 C1 一</p></div></div>')
+    return _page(f'{title}<table class="danwa"><tbody>{"".join(rows)}</tbody></table>', kb)
+
+def syutuba_page(place, rr, kb):
+    rows = []
+    for n in range(1, horse_count(place, rr) + 1):
+        r = _rng("syutuba", place, rr, n)
+        name = r.choice(JOCKEYS)
+        anchor = f"<strong>{name}</strong>" if r.random() < 0.1 else name
+        rows.append(f'<tr><td class="waku">{n}</td><td><p class="bamei">ベンチホース{n}</p>'
+                    f'<p class="kisyu"><a href="/kisyu/{n}">{anchor}</a></p></td></tr>')
+    return _page(f'<table class="syutuba_sp"><tbody>{"".join(rows)}</tbody></table>', kb)
+
+def cyokyo_page(place, rr, kb):
+    tables = []
+    for n in range(1, horse_count(place, rr) + 1):
+        r = _rng("cyokyo", place, rr, n)
+        detail = " ".join(f"{r.randint(60, 90)}.{r.randint(0, 9)}" for _ in range(5))
+        tables.append(f'<table class="cyokyo"><tbody>'
+                      f'<tr><td class="umaban">{n}</td><td class="kbamei">ベンチホース{n}</td><td class="tanpyo">{r.choice(TANPYO)}</td></tr>'
+                      f'<tr><td colspan="3">助手 {r.randint(1, 12)}/{r.randint(1, 28)} 大井良 {detail} 馬なり余力</td></tr>'
+                      f'</tbody></table>')
+    return _page("".join(tables), kb)
+
+def run_date(run_no):
+    """タイム指数ページの近走の日付 (run_no=0が前走)"""
+    return LAST_RUN_DATE - datetime.timedelta(days=28 * run_no)
+
+def speed_page(place, rr, kb):
+    rows = []
+    for n in range(1, horse_count(place, rr) + 1):
+        r = _rng("speed", place, rr, n)
+        # 実ページと同じく [5走前] ... [前走] の古い順 (走った日付も入れ、近走の並びを確認できるようにする)
+        past = "".join(f'<td>{run_date(i):%Y.%m.%d} <span>{r.choice(list(PLACES.values()))}{r.choice(SURFACE_DISTANCES)}'
+                       f'</span> 良 <a href="#">{r.randint(35, 75)}</a></td>' for i in range(4, -1, -1))
+        rows.append(f'<tr class="HorseList"><td class="Umaban">{n}</td><td class="Horse_Name">ベンチホース{n}</td>'
+                    f'<td>{r.randint(60, 80)}</td>{past}</tr>')
+    body = (f'<div class="RaceData01">{14 + rr // 3}:{rr % 3 * 20:02d}発走 / ダ1400m (右)</div>'
+            f'<table class="SpeedIndex_Table">{"".join(rows)}</table>')
+    return _page(body, kb, "EUC-JP")
+
+
+# ==================================================
+# HTTPハンドラ
+# ==================================================
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    state: BenchState = None
+
+    def log_message(self, *args):
+        pass
+
+    # ---------- 共通 ----------
+
+    def _send(self, status, body=b"", content_type="text/html", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _cookie(self, name):
+        return f"{name}=1" in (self.headers.get("Cookie") or "")
+
+    def _fixture(self, kind):
+        d = self.state.args.fixtures
+        path = os.path.join(d, f"{kind}.html") if d else None
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+        return None
+
+    def _serve_page(self, kind, key, render, charset="utf-8"):
+        start = time.time()
+        time.sleep(self.state.args.page_latency)
+        body = self._fixture(kind) or render().encode(charset)
+        # netkeiba同様、Content-Typeにcharsetを付けない (metaタグ判定の経路を通す)
+        self._send(200, body, "text/html" if charset != "utf-8" else "text/html; charset=UTF-8")
+        self.state.record(kind, key, start, time.time(), len(body))
+
+    # ---------- GET ----------
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        q = parse_qs(url.query)
+        kb = self.state.args.page_kb
+        if m := re.fullmatch(r"/chihou/nittei/(\d{8})10", url.path):
+            return self._serve_page("schedule", m.group(1), lambda: schedule_page(m.group(1), kb))
+        if m := re.fullmatch(r"/chihou/(danwa|syutuba|cyokyo)(?:/1)?/(\d{16})", url.path):
+            kind, rid = m.groups()
+            place, rr = rid[6:8], int(rid[10:12])
+            render = {"danwa": danwa_page, "syutuba": syutuba_page, "cyokyo": cyokyo_page}[kind]
+            return self._serve_page(kind, f"{place}-{rr:02d}", lambda: render(place, rr, kb))
+        if url.path == "/race/speed.html":
+            nk_id = q.get("race_id", [""])[0]
+            place, rr = NK_TO_KB_CODE.get(nk_id[4:6], "10"), int(nk_id[-2:] or 1)
+            return self._serve_page("speed", f"{place}-{rr:02d}", lambda: speed_page(place, rr, kb), "euc-jp")
+        if url.path == "/login/login":
+            if self._cookie("kb_session"):
+                return self._send(200, _page("<p>ログイン中</p>", 1).encode())
+            form = ('<form method="post" action="/login/login"><input name="login_id">'
+                    '<input type="password" name="pswd"><input type="submit" value="ログイン"></form>')
+            return self._send(200, f"<html><body>{form}</body></html>".encode())
+        if url.path == "/account/":
+            if q.get("pid") == ["login"] and not self._cookie("nk_session"):
+                form = ('<form method="post" action="/account/"><input name="login_id">'
+                        '<input type="password" name="pswd"><input type="submit" class="SubmitBtn"></form>')
+                return self._send(200, f"<html><body>{form}</body></html>".encode())
+            return self._send(200, _page("<p>マイページ</p>", 1).encode())
+        if url.path == "/":
+            return self._send(200, _page("<p>トップ</p>", 1).encode())
+        if url.path.startswith("/rest/v1/"):
+            return self._send(200, b"[]", "application/json")
+        if url.path == "/__bench/log":
+            with self.state.lock:
+                body = json.dumps({"log": self.state.log}).encode()
+            return self._send(200, body, "application/json")
+        return self._send(404, b"not found")
+
+    # ---------- POST ----------
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self._read_body()
+        if url.path == "/login/login":
+            return self._send(302, headers={"Location": "/", "Set-Cookie": "kb_session=1; Path=/"})
+        if url.path == "/account/":
+            return self._send(302, headers={"Location": "/account/?pid=top", "Set-Cookie": "nk_session=1; Path=/"})
+        if url.path == "/v1/workflows/run":
+            return self._dify_stream(json.loads(body or b"{}"))
+        if url.path.startswith("/rest/v1/"):
+            start = time.time()
+            time.sleep(self.state.args.page_latency)
+            self._send(201, b"[]", "application/json")
+            return self.state.record("supabase", "", start, time.time(), len(body))
+        if url.path == "/__bench/reset":
+            with self.state.lock:
+                self.state.log.clear()
+                self.state.dify_calls = 0
+            return self._send(204)
+        return self._send(404, b"not found")
+
+    def do_PATCH(self):
+        self._read_body()
+        self._send(204)
+
+    def _write_chunk(self, body):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(body), body))
+        self.wfile.flush()
+
+    def _dify_stream(self, payload):
+        """Dify SSEの模擬 (最初のトークンまでの遅延と毎秒トークン数を指定可能)"""
+        args = self.state.args
+        with self.state.lock:
+            self.state.dify_calls += 1
+            seq = self.state.dify_calls
+        start = time.time()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked") # 実際のDifyと同じくチャンク単位で送る
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        time.sleep(args.ttft)
+        prompt = payload.get("inputs", {}).get("text", "")
+        token = "◎本命は指数上位で乗り替わりなし。"
+        n_tokens = args.answer_tokens
+        for i in range(n_tokens):
+            chunk = json.dumps({"event": "message", "answer": token if i % 8 else f"\n\n{i // 8 + 1}. "}, ensure_ascii=False)
+            self._write_chunk(f"data: {chunk}\n\n".encode())
+            time.sleep(1 / args.token_rate)
+        self._write_chunk(b'data: {"event": "workflow_finished"}\n\n')
+        self.wfile.write(b"0\r\n\r\n")
+        self.state.record("dify", seq, start, time.time(), len(prompt.encode()))
+
+
+def serve(args, ready=None):
+    Handler.state = BenchState(args)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    if ready is not None:
+        ready.set()
+    server.serve_forever()
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--fixtures", default=None, help="録画済みページのディレクトリ")
+    p.add_argument("--page-kb", type=float, default=80, help="生成ページのおおよそのサイズ (KB)")
+    p.add_argument("--page-latency", type=float, default=0.15, help="各ページ応答の遅延 (秒)")
+    p.add_argument("--ttft", type=float, default=1.5, help="Difyの最初のトークンまでの遅延 (秒)")
+    p.add_argument("--token-rate", type=float, default=40, help="Difyの毎秒トークン数")
+    p.add_argument("--answer-tokens", type=int, default=120, help="Difyの回答トークン数")
+    return p
+
+
+if __name__ == "__main__":
+    serve(build_parser().parse_args())
@@ -0,0 +1,84 @@
+"""起動・再実行ベンチマーク: 設定画面の初回表示と、ウィジェット操作ごとの再実行にかかる時間を計測する
+
+    python bench/startup_bench.py --reruns 20
+
+分析は実行しない (サーバー不要)。初回表示時に読み込まれた重いモジュールも出力する。
+"""
+import argparse
+import datetime
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(os.path.dirname(HERE), "app.py")
+
+# 設定画面の表示だけなら読み込まれないはずのモジュール
+HEAVY_MODULES = ("selenium", "supabase", "bs4", "pandas", "pyarrow", "altair", "requests")
+
+
+def make_app(args):
+    from streamlit.testing.v1 import AppTest
+
+    # AppTest実行時の「missing ScriptRunContext」警告を抑制
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.secrets["ADMIN_PASSWORD"] = "bench"
+    at.session_state["password_correct"] = True
+    return at
+
+
+def timed(func):
+    t0 = time.perf_counter()
+    func()
+    return time.perf_counter() - t0
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--reruns", type=int, default=20, help="ウィジェット操作による再実行の回数")
+    p.add_argument("--timeout", type=float, default=60)
+    p.add_argument("--workdir", default=None, help="キャッシュ等の作業ディレクトリ (既定は一時ディレクトリ)")
+    args = p.parse_args()
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="nar-startup-"))
+
+    # Streamlit本体の読み込みはアプリと無関係なので計測前に済ませる
+    t0 = time.perf_counter()
+    import streamlit  # noqa: F401
+    from streamlit.testing.v1 import AppTest  # noqa: F401
+    streamlit_s = time.perf_counter() - t0
+
+    at = make_app(args)
+    first_s = timed(at.run)
+    loaded = sorted(m for m in HEAVY_MODULES if m in sys.modules)
+
+    # 設定画面の典型的な操作 (レース選択の切り替え・日付変更・場所変更) を繰り返す
+    actions = [
+        lambda: [c for c in at.checkbox if c.label == "全レースを一括分析する"][0].uncheck(),
+        lambda: at.checkbox(key="r3").check(),
+        lambda: [c for c in at.checkbox if c.label == "全レースを一括分析する"][0].check(),
+        lambda: at.date_input[0].set_value(datetime.date(2025, 12, 26)),
+        lambda: at.selectbox[0].set_value("11"),
+        lambda: at.selectbox[0].set_value("10"),
+    ]
+    reruns = []
+    for i in range(args.reruns):
+        actions[i % len(actions)]()
+        reruns.append(timed(at.run))
+    errors = [e.body for e in at.exception]
+
+    print(f"streamlit import      {streamlit_s:6.3f} s (計測対象外)")
+    print(f"first render          {first_s:6.3f} s (app.py の読み込みを含む)")
+    print(f"rerun median          {statistics.median(reruns) * 1000:6.1f} ms")
+    print(f"rerun p90             {sorted(reruns)[int(len(reruns) * 0.9) - 1] * 1000:6.1f} ms (n={len(reruns)})")
+    print(f"heavy modules loaded  {', '.join(loaded) or 'なし'}")
+    if errors:
+        print("errors:", *errors, sep="\n  ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, NamedTuple
+
+import race_pipeline
+from places import PLACE_NAMES
+from race_pipeline import (RaceStores, analyze_race, save_history, fetch_race_ids_from_schedule, post_times,
+                           collect_race_data, iter_prefetched)
+from fetcher import HttpFetcher
+from page_wait import PageWaiter
+from timing import Timeline
+from memory_governor import DEFAULT_MEMORY_LIMIT_MB, MemoryGovernor
+
+# ==================================================
+# 分析ジョブ (同じ条件の実行を全セッションで1回にまとめ、同時実行数を制限)
+# ==================================================
+
+@dataclass(frozen=True)
+class CardParams:
+    """1回の分析の条件 (同じ条件なら実行中のジョブに相乗りする)"""
+    target_date: date
+    place_code: str
+    races: tuple = ()            # 空なら全レース
+    refresh: bool = False
+    force_races: tuple = ()
+    use_answer_cache: bool = True
+    prompt_format: str = "compact"
+    token_budget: int = 2500
+    resume: bool = False         # チェックポイントのあるレースは取得・AI分析を省略
+    # 以下は結果に影響しない実行設定 (相乗りの判定には使わない)
+    workers: int = 4
+    per_host: int = 2
+    prefetch: int = 2
+    use_page_cache: bool = True
+    save_timings: bool = False
+    memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB
+    archive_pages: bool = True   # 取得したページを PageArchive に保存 (バックテスト用)
+
+    def key(self) -> tuple:
+        return (self.target_date, self.place_code, self.races, self.refresh, self.force_races,
+                self.use_answer_cache, self.prompt_format, self.token_budget, self.resume)
+
+
+class CardResources(NamedTuple):
+    """プロセス内で共有する資源 (Streamlit側で用意して渡す)"""
+    sessions: Any       # SessionManager
+    page_cache: Any     # PageCache
+    answer_cache: Any   # AnswerCache
+    supabase: Any       # Client | None
+    writer: Any         # HistoryWriter
+    speed_store: Any    # SpeedStore
+    snapshots: Any      # SnapshotStore
+    checkpoints: Any    # CheckpointStore
+    archive: Any        # PageArchive
+
+
+class Job:
+    """ジョブの進捗 (ワーカースレッドが更新し、閲覧中の各セッションが描画する)"""
+
+    def __init__(self, params: CardParams):
+        self.params = params
+        self.state = "queued" # queued / running / done
+        self.error = None
+        self.timeline = Timeline()
+        self.waiter = PageWaiter()
+        self.memory = None # MemoryGovernor (実行開始後)
+        self.page_stats = [] # このジョブ中のログイン時のブラウザ通信量 (完了時に設定)
+        self.cache_stats = {} # このジョブのページキャッシュ ヒット/再検証/取得 (完了時に設定)
+        self.saves = {"pending": 0, "saved": 0, "journaled": 0, "error": None} # このジョブの履歴保存 (送信は非同期)
+        self.finished_at = None
+        self.version = 0
+        self._messages = []
+        self._races = {}
+        self._cond = threading.Condition()
+
+    # ---------- ワーカー側 ----------
+
+    def message(self, level: str, text: str):
+        with self._cond:
+            self._messages.append((level, text))
+            self._changed()
+
+    def add_race(self, race_id: str, title: str):
+        with self._cond:
+            self._races[race_id] = {"title": title, "status": ("info", "📚 データ収集待ち..."), "note": None,
+                                    "changes": None, "parts": [], "streaming": False,
+                                    "peak_mb": None}
+            self._changed()
+
+    def update_race(self, race_id: str, **fields):
+        with self._cond:
+            self._races[race_id].update(fields)
+            self._changed()
+
+    def append_text(self, race_id: str, chunk: str):
+        with self._cond:
+            self._races[race_id]["parts"].append(chunk) # 文字列の += を避け、表示時にだけ結合する
+            self._changed()
+
+    def save_submitted(self):
+        with self._cond:
+            self.saves["pending"] += 1
+            self._changed()
+
+    def save_result(self, ok: bool, error: str | None):
+        """HistoryWriter の書き込みスレッドから呼ばれる"""
+        with self._cond:
+            self.saves["pending"] -= 1
+            self.saves["saved" if ok else "journaled"] += 1
+            if error: self.saves["error"] = error
+            self._changed()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.state = "done"
+            self.error = error
+            self.finished_at = time.time()
+            self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self._cond.notify_all()
+
+    # ---------- 表示側 ----------
+
+    def wait(self, version: int, timeout: float) -> int:
+        """version から更新があるまで待機 (最新の version を返す)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def view(self):
+        """(状態, メッセージ, レースごとの状態) の複製 (状態も同じロック内で読むため、"done" なら最終結果)"""
+        with self._cond:
+            races = {rid: {**r, "text": "".join(r["parts"])} for rid, r in self._races.items()}
+            return self.state, list(self._messages), races
+
+
+class JobManager:
+    """条件が同じジョブは1回だけ実行し、同時実行数を max_running に制限する"""
+
+    def __init__(self, max_running: int = 1, keep_seconds: float = 1800):
+        self.max_running = max(1, max_running)
+        self.keep_seconds = keep_seconds
+        self._jobs = {}
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        for i in range(self.max_running):
+            threading.Thread(target=self._worker, name=f"card-job-{i}", daemon=True).start()
+
+    def submit(self, params: CardParams, target) -> tuple:
+        """(ジョブ, 新規作成か) を返す。同じ条件のジョブが待機中・実行中ならそれに相乗り"""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(params.key())
+            if job is not None and job.state != "done":
+                return job, False
+            job = Job(params)
+            self._jobs[params.key()] = job
+            self._pending.append(job)
+        self._queue.put((job, target))
+        return job, True
+
+    def position(self, job: Job) -> int:
+        """待ち順 (1が次に実行、実行中・完了は0)"""
+        with self._lock:
+            return self._pending.index(job) + 1 if job in self._pending else 0
+
+    def running(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.state == "running")
+
+    def _worker(self):
+        while True:
+            job, target = self._queue.get()
+            with self._lock:
+                self._pending.remove(job)
+                job.state = "running"
+            try:
+                target(job)
+                job.finish()
+            except Exception as e:
+                job.finish(str(e))
+
+    def _prune(self):
+        now = time.time()
+        for key, job in list(self._jobs.items()):
+            if job.state == "done" and now - job.finished_at > self.keep_seconds:
+                del self._jobs[key]
+
+
+class JobHistoryWriter:
+    """履歴の送信結果をジョブごとに数える (HistoryWriter はプロセス全体で共有)"""
+
+    def __init__(self, writer, job: Job):
+        self.writer = writer
+        self.job = job
+
+    def submit(self, record: dict):
+        self.job.save_submitted()
+        self.writer.submit(record, self.job.save_result)
+
+
+class JobLogHandler(logging.Handler):
+    """ジョブの実行スレッドと取得プールのスレッド (名前が thread_prefix で始まる) からのログをジョブのメッセージに追加"""
+
+    def __init__(self, job: Job, thread_prefix: str):
+        super().__init__(logging.INFO)
+        self.job = job
+        self.thread = threading.get_ident()
+        self.thread_prefix = thread_prefix
+
+    def emit(self, record):
+        if record.thread != self.thread and not record.threadName.startswith(self.thread_prefix): return
+        level = "error" if record.levelno >= logging.ERROR else "warning" if record.levelno >= logging.WARNING else "info"
+        self.job.message(level, record.getMessage())
+
+
+def run_card(job: Job, res: CardResources):
+    """1開催分の取得・AI分析・保存 (ジョブのワーカースレッドで実行)"""
+    p = job.params
+    year_str, month_str, day_str = p.target_date.strftime("%Y"), p.target_date.strftime("%m"), p.target_date.strftime("%d")
+    place_name = PLACE_NAMES.get(p.place_code, "不明")
+    timeline, waiter = job.timeline, job.waiter
+
+    # Chromeはログインのみに使用し、以降のページはHTTPで取得する (ログイン済みCookieはジョブ間で共有)
+    cache = res.page_cache if p.use_page_cache else None
+    fetcher = HttpFetcher(pool_size=p.workers * 2, max_per_host=p.per_host, waiter=waiter, cache=cache)
+    thread_prefix = f"card-{id(job):x}"
+    pool = ThreadPoolExecutor(max_workers=p.workers, thread_name_prefix=thread_prefix)
+    log_handler = JobLogHandler(job, thread_prefix + "_")
+    race_pipeline.logger.addHandler(log_handler)
+    race_pipeline.logger.setLevel(logging.INFO)
+    logins = len(res.sessions.page_stats) # このジョブ中のログインの通信量だけを表示する
+    # 上限を超えたら常駐ブラウザを破棄 (ログイン済みCookieは残るため、再ログインは切れたサイトのみ)
+    governor = job.memory = MemoryGovernor(p.memory_limit_mb, browser_mb=res.sessions.browser_mb,
+                                           on_limit=res.sessions.recycle).start()
+
+    try:
+        job.message("info", "🔑 ログイン状態を確認中...")
+        with timeline.span("login"):
+            login_status = res.sessions.ensure_logged_in(fetcher, waiter)
+        if not login_status["keibabook"]:
+            job.message("warning", "⚠️ 競馬ブック未ログイン (談話・調教が取得できない可能性があります)")
+
+        # Netkeibaログイン (タイム指数用)
+        if login_status["netkeiba"]:
+            job.message("success", "✅ Netkeibaログイン成功")
+        else:
+            job.message("warning", "⚠️ Netkeibaログイン失敗 (タイム指数は取得できない可能性があります)")
+
+        job.message("info", "📡 レースIDを取得中...")
+        with timeline.span("schedule"):
+            race_ids = fetch_race_ids_from_schedule(fetcher, year_str, month_str, day_str, p.place_code)
+            start_times = post_times(fetcher, year_str, month_str, day_str, p.place_code)
+        race_ids = [rid for rid in race_ids if not p.races or int(rid[10:12]) in p.races]
+
+        if not race_ids:
+            job.message("error", "レース情報が見つかりませんでした。")
+            return
+
+        # レースごとの表示枠 (結果はレース順に表示)
+        for race_id in race_ids:
+            post = f" ({start_times[race_id]} 発走)" if race_id in start_times else ""
+            job.add_race(race_id, f"{place_name} {int(race_id[10:12])}R{post}")
+
+        # 再開時はチェックポイントの取得データを使い、回答済みのレースはそのまま表示する
+        # (プロンプト形式・トークン上限が前回と違うレースは取得からやり直す)
+        settings = {"prompt_format": p.prompt_format, "token_budget": p.token_budget}
+        checkpoints = {rid: res.checkpoints.get(rid) for rid in race_ids} if p.resume else {}
+        checkpoints = {rid: cp for rid, cp in checkpoints.items() if cp and cp["settings"] == settings}
+        stores = RaceStores(res.answer_cache, res.snapshots, res.supabase, JobHistoryWriter(res.writer, job),
+                            res.checkpoints)
+
+        previous = {} # リフレッシュ時の前回のスナップショット (指紋が同じなら前回の回答を使う)
+
+        def collect(rid):
+            governor.begin(int(rid[10:12]))
+            if rid in checkpoints: return checkpoints[rid]["race"]
+            previous[rid] = res.snapshots.get(rid) if p.refresh else None
+            race = collect_race_data(fetcher, rid, year_str, month_str, day_str, p.place_code, place_name, timeline,
+                                     res.speed_store, previous[rid],
+                                     p.prompt_format, p.token_budget, res.archive if p.archive_pages else None)
+            if race["prompt"]: res.checkpoints.collected(race, settings)
+            return race
+
+        # 取得ステージ (ワーカープール、同時 workers レース) → 取得済み上限付きキュー → AIステージ (レース順)
+        for race_id, future in iter_prefetched(pool, collect, race_ids, p.prefetch, p.workers):
+            race_num = int(race_id[10:12])
+            try:
+                with timeline.span("wait.collect", race_num):
+                    race = future.result()
+                # 準備完了マーカーが無いページ (未公開・未ログイン等) を明示
+                missing = waiter.missing_pages(race["urls"])
+                # ログインが必要なページに表が無い場合はログイン切れとみなし、再ログインして取り直す
+                if missing and race_id not in checkpoints and res.sessions.recover(fetcher, waiter, missing):
+                    job.message("info", f"🔑 {race_num}R: ログイン切れのため再ログインしてページを取り直しました")
+                    race = collect(race_id)
+                    missing = waiter.missing_pages(race["urls"])
+                if missing:
+                    job.update_race(race_id, note=("warning", f"⚠️ 表データが見つからないページがあります ({', '.join(missing)})"))
+                prompt = race["prompt"]
+                if not prompt:
+                    job.update_race(race_id, status=("warning", "データが取得できませんでした。スキップします。"))
+                    continue
+
+                cp = checkpoints.get(race_id)
+                if cp and cp["stage"] != "collected":
+                    if cp["stage"] == "answered" and res.supabase: # 履歴保存の前に中断していた
+                        save_history(race, cp["answer"], stores, year_str, month_str, day_str, p.place_code, place_name,
+                                     ab=p.prompt_format == "ab")
+                        res.checkpoints.saved(race_id)
+                    job.update_race(race_id, parts=[cp["answer"]], changes=race["changes"],
+                                    status=("success", "⏯ 分析済みのため前回の結果を表示しました"))
+                    continue
+
+                # リフレッシュ時は前回からの変更点を表示
+                if race["changes"] is not None:
+                    job.update_race(race_id, changes=race["changes"])
+
+                # E. AI分析 (ストリーミング) と F. 保存
+                # 入力データが前回と同一なら保存済みの回答を再表示 (Dify呼び出しを省略)
+                on_start = lambda: job.update_race(race_id, streaming=True, status=(
+                    "info", f"🤖 AI分析を実行中... (入力 約{race['prompt_tokens']:,} トークン・{race['prompt_format']})"))
+                result = analyze_race(race, stores, year_str, month_str, day_str, p.place_code, place_name,
+                                      use_cache=(p.use_answer_cache or p.refresh) and race_num not in p.force_races,
+                                      previous=previous.get(race_id),
+                                      ab=p.prompt_format == "ab", timeline=timeline, save_timings=p.save_timings,
+                                      on_start=on_start, on_chunk=lambda chunk: job.append_text(race_id, chunk))
+                if result.reused:
+                    job.update_race(race_id, parts=[result.answer],
+                                    status=("success", "♻️ 入力データに変更がないため保存済みの回答を表示しました"))
+                elif result.failed:
+                    job.update_race(race_id, streaming=False, status=(
+                        "error", f"AI分析に失敗しました ({result.stats.get('error') or '空の回答'})"))
+                else:
+                    job.update_race(race_id, streaming=False, status=(
+                        "success", f"分析完了 (初回応答 {result.stats.get('ttft') or 0:.1f} 秒・"
+                                   f"{result.stats.get('tokens_per_sec', 0):.0f} トークン/秒)"))
+
+            except Exception as e:
+                job.update_race(race_id, streaming=False, status=("error", f"エラー発生: {e}"))
+            finally:
+                governor.end(race_num)
+                job.update_race(race_id, peak_mb=governor.peak_of(race_num))
+
+    finally:
+        job.page_stats = res.sessions.page_stats[logins:]
+        if cache: job.cache_stats = dict(fetcher.cache_stats)
+        res.writer.flush(timeout=0) # 一括送信の待ち時間を待たずに、このジョブの履歴をすぐ送信させる (完了は待たない)
+        governor.stop()
+        pool.shutdown(wait=False, cancel_futures=True)
+        fetcher.close()
+        race_pipeline.logger.removeHandler(log_handler)
@@ -0,0 +1,72 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ==================================================
+# レースごとのチェックポイント (中断した分析を完了済みのレースから再開)
+# ==================================================
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(".cache", "checkpoints.sqlite3")
+
+# 進み具合 (collected: データ取得・プロンプト作成済み / answered: AI回答済み / saved: 履歴保存まで完了)
+STAGES = ("collected", "answered", "saved")
+
+# collect_race_data の戻り値のうち再開に必要なもの (scores 等は prompt に反映済みのため保存しない)
+RACE_KEYS = ("race_id", "race_num", "urls", "race_meta", "danwa", "jockey", "cyokyo", "speed", "prompt",
+             "prompt_format", "prompt_tokens", "snapshot", "fingerprint", "changes")
+
+
+class CheckpointStore:
+    """race_id ごとに取得データ・プロンプト・回答・保存状況を保存"""
+
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " race_id TEXT PRIMARY KEY, stage TEXT, race TEXT, answer TEXT, updated_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, race_id: str) -> dict | None:
+        """{"stage", "race", "settings", "answer", "updated_at"} (未保存ならNone)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stage, race, answer, updated_at FROM checkpoints WHERE race_id = ?", (race_id,)
+            ).fetchone()
+        if not row: return None
+        race = json.loads(row[1])
+        settings = race.pop("settings", None)
+        return {"stage": row[0], "race": race, "settings": settings, "answer": row[2], "updated_at": row[3]}
+
+    def collected(self, race: dict, settings: dict | None = None):
+        """データ取得直後 (回答は未取得に戻す)
+        settings: プロンプトの作成条件 (prompt_format, token_budget)。再開時は同じ条件のものだけ使う"""
+        data = json.dumps({**{k: race.get(k) for k in RACE_KEYS}, "settings": settings}, ensure_ascii=False, default=str)
+        self._write("INSERT OR REPLACE INTO checkpoints VALUES (?, 'collected', ?, NULL, ?)",
+                    (race["race_id"], data, time.time()))
+
+    def answered(self, race_id: str, answer: str):
+        self._write("UPDATE checkpoints SET stage = 'answered', answer = ?, updated_at = ? WHERE race_id = ?",
+                    (answer, time.time(), race_id))
+
+    def saved(self, race_id: str):
+        self._write("UPDATE checkpoints SET stage = 'saved', updated_at = ? WHERE race_id = ?", (time.time(), race_id))
+
+    def clear(self):
+        self._write("DELETE FROM checkpoints", ())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- 内部処理 ----------
+
+    def _write(self, sql, args):
+        with self._lock:
+            self._conn.execute(sql, args)
+            self._conn.commit()
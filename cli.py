@@ -0,0 +1,234 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import race_pipeline
+from places import PLACE_NAMES
+from race_pipeline import (RaceStores, analyze_race, create_supabase_client, get_driver, site_logins,
+                           fetch_race_ids_from_schedule, collect_race_data, iter_prefetched)
+from fetcher import HttpFetcher
+from page_wait import PageWaiter
+from page_cache import PageCache
+from history_writer import HistoryWriter
+from answer_cache import AnswerCache
+from session_manager import SessionManager
+from memory_governor import DEFAULT_MEMORY_LIMIT_MB, MemoryGovernor
+from speed_store import SpeedStore
+from race_snapshot import SnapshotStore
+from page_archive import DEFAULT_ARCHIVE_MAX_MB, PageArchive
+from prompt_encoder import PROMPT_FORMATS, DEFAULT_TOKEN_BUDGET
+
+# ==================================================
+# コマンドライン一括実行 (Streamlit不要・cron等での夜間バッチ用)
+#   python cli.py --from 2026-10-12 --to 2026-10-16 --venues 10 12
+# ==================================================
+
+logger = logging.getLogger("nar.cli")
+
+
+def parse_date(text: str) -> date:
+    return datetime.strptime(text.replace("/", "-"), "%Y-%m-%d").date()
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="指定期間・競馬場の全レースを取得してAI分析し、履歴に保存する")
+    p.add_argument("--from", dest="date_from", type=parse_date, default=date.today(), help="開始日 (YYYY-MM-DD、既定は今日)")
+    p.add_argument("--to", dest="date_to", type=parse_date, default=None, help="終了日 (既定は開始日と同じ)")
+    p.add_argument("--venues", nargs="+", choices=sorted(PLACE_NAMES), default=sorted(PLACE_NAMES),
+                   help="競馬ブックの場所コード (10:大井 11:川崎 12:船橋 13:浦和)")
+    p.add_argument("--jobs", type=int, default=2, help="同時に処理する 日付×競馬場 の数")
+    p.add_argument("--workers", type=int, default=4, help="ページ取得ワーカー数 (全ジョブ共通)")
+    p.add_argument("--per-host", type=int, default=2, help="同一サイトへの同時接続数")
+    p.add_argument("--prefetch", type=int, default=2, help="取得済みでAI分析待ちにしておくレース数の上限")
+    p.add_argument("--ai-concurrency", type=int, default=2, help="Difyへの同時リクエスト数")
+    p.add_argument("--prompt-format", choices=PROMPT_FORMATS, default="compact",
+                   help="compact: 表形式 / verbose: 従来形式 / ab: レースごとに振り分けて比較")
+    p.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="1レースの入力トークン上限 (compact)")
+    p.add_argument("--no-cache", action="store_true", help="ページキャッシュを使わない")
+    p.add_argument("--no-archive", action="store_true", help="取得したページをアーカイブしない (replay.py 用)")
+    p.add_argument("--archive-max-mb", type=float, default=DEFAULT_ARCHIVE_MAX_MB,
+                   help="アーカイブの合計サイズ上限 (MB、超えたら開催日の古い順に削除)")
+    p.add_argument("--full-browser", action="store_true", help="ログイン用ブラウザで画像・CSS・広告も読み込む")
+    p.add_argument("--refresh", action="store_true",
+                   help="談話・出馬表だけ再取得し、前回から変わったレースだけ再分析する")
+    p.add_argument("--force", action="store_true", help="入力が前回と同じでもAIを再実行する")
+    p.add_argument("--memory-limit", type=float, default=DEFAULT_MEMORY_LIMIT_MB,
+                   help="Python本体とChromeの合計RSSの上限 (MB、超えたら常駐ブラウザを破棄)")
+    p.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"),
+                   help="認証情報のTOML (環境変数の値が優先)")
+    p.add_argument("--log-file", default=None, help="ログの出力先ファイル (標準出力にも出力)")
+    return p
+
+
+def load_settings(path: str) -> dict:
+    """secrets.toml を読み込み、同名の環境変数で上書き"""
+    settings = {}
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            settings.update(tomllib.load(f))
+    settings.update({k: v for k, v in os.environ.items() if k in race_pipeline.Config.__dataclass_fields__})
+    return settings
+
+
+def setup_logging(log_file: str | None):
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        if os.path.dirname(log_file):
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    fmt = logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s")
+    root = logging.getLogger("nar")
+    for h in handlers:
+        h.setFormatter(fmt)
+        root.addHandler(h)
+    root.setLevel(logging.INFO)
+
+
+class BatchRunner:
+    """日付×競馬場のジョブを並列実行 (取得プール・HTTPセッション・ログインは全ジョブで共有)"""
+
+    def __init__(self, args):
+        self.args = args
+        self.waiter = PageWaiter()
+        self.cache = None if args.no_cache else PageCache()
+        self.fetcher = HttpFetcher(pool_size=args.workers * 2, max_per_host=args.per_host,
+                                   waiter=self.waiter, cache=self.cache)
+        self.pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="fetch")
+        self.supabase = create_supabase_client()
+        self.writer = HistoryWriter(lambda: self.supabase)
+        self.answers = AnswerCache()
+        self.speed_store = SpeedStore()
+        self.snapshots = SnapshotStore()
+        self.archive = None if args.no_archive else PageArchive(max_bytes=int(args.archive_max_mb * 1024 * 1024))
+        self.stores = RaceStores(self.answers, self.snapshots, self.supabase, self.writer)
+        self.sessions = SessionManager(lambda: get_driver(not args.full_browser), site_logins(),
+                                       lean=not args.full_browser)
+        self.memory = MemoryGovernor(args.memory_limit, browser_mb=self.sessions.browser_mb,
+                                     on_limit=self.sessions.recycle)
+        self.counts = {"analyzed": 0, "reused": 0, "skipped": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def run(self, jobs) -> bool:
+        replayed = self.writer.replay_journal()
+        if replayed:
+            logger.info(f"前回未送信の履歴 {replayed} 件を再送します")
+        self.memory.start()
+        try:
+            status = self.sessions.ensure_logged_in(self.fetcher, self.waiter)
+            logger.info("ログイン状態: " + ", ".join(f"{k}={'OK' if v else 'NG'}" for k, v in status.items()))
+            for stats in self.sessions.page_stats:
+                saved = stats.get("bytes_saved")
+                logger.info(f"ブラウザ通信量 {stats['site']}: {stats['requests']} リクエスト / "
+                            f"{stats['bytes'] / 1024:.0f} KB / 遮断 {stats['blocked']} 件"
+                            + (f" / 節約 {saved / 1024:.0f} KB" if saved is not None else ""))
+            with ThreadPoolExecutor(max_workers=max(1, self.args.jobs), thread_name_prefix="job") as jobs_pool:
+                list(jobs_pool.map(lambda job: self.run_job(*job), jobs))
+        finally:
+            self.memory.stop()
+            self.sessions.close()
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.fetcher.close()
+            if not self.writer.flush(timeout=60):
+                spilled = self.writer.spill_pending()
+                logger.warning(f"履歴の送信が完了しないまま終了します (未送信の {spilled} 件はローカルに退避し、次回再送)")
+        if self.writer.last_error:
+            logger.error(f"Supabase save error: {self.writer.last_error}")
+        if self.writer.journaled:
+            logger.warning(f"Supabaseに保存できなかった履歴 {self.writer.journaled} 件をローカルに退避しました")
+        logger.info("完了: " + ", ".join(f"{k}={v}" for k, v in self.counts.items())
+                    + f", メモリ最大 {self.memory.peak_mb:.0f} MB, ブラウザ破棄 {self.memory.recycles} 回")
+        return self.counts["failed"] == 0
+
+    def run_job(self, day: date, place_code: str):
+        year, month, dd = day.strftime("%Y"), day.strftime("%m"), day.strftime("%d")
+        place_name = PLACE_NAMES[place_code]
+        label = f"{day:%Y-%m-%d} {place_name}"
+        try:
+            race_ids = fetch_race_ids_from_schedule(self.fetcher, year, month, dd, place_code)
+        except Exception as e:
+            logger.error(f"{label}: 日程取得エラー: {e}")
+            self._count("failed")
+            return
+        if not race_ids:
+            logger.info(f"{label}: 開催なし")
+            return
+        logger.info(f"{label}: {len(race_ids)} レース")
+
+        previous = {} # リフレッシュ時の前回のスナップショット (指紋が同じなら前回の回答を使う)
+
+        def collect(rid):
+            previous[rid] = self.snapshots.get(rid) if self.args.refresh else None
+            return collect_race_data(self.fetcher, rid, year, month, dd, place_code, place_name,
+                                     speed_store=self.speed_store, previous=previous[rid],
+                                     prompt_format=self.args.prompt_format,
+                                     token_budget=self.args.token_budget, archive=self.archive)
+
+        for race_id, future in iter_prefetched(self.pool, collect, race_ids, self.args.prefetch, self.args.workers):
+            race_label = f"{label} {int(race_id[10:12])}R"
+            try:
+                race = future.result()
+                missing = self.waiter.missing_pages(race["urls"])
+                # ログインが必要なページに表が無い場合はログイン切れとみなし、再ログインして取り直す
+                if missing and self.sessions.recover(self.fetcher, self.waiter, missing):
+                    logger.info(f"{race_label}: ログイン切れのため再ログインしてページを取り直しました")
+                    race = collect(race_id)
+                    missing = self.waiter.missing_pages(race["urls"])
+                if missing:
+                    logger.warning(f"{race_label}: 表データが見つからないページがあります ({', '.join(missing)})")
+                self.analyze(race, previous.get(race_id), year, month, dd, place_code, place_name, race_label)
+            except Exception as e:
+                logger.error(f"{race_label}: エラー発生: {e}")
+                self._count("failed")
+
+    def analyze(self, race, previous, year, month, day, place_code, place_name, race_label):
+        prompt = race["prompt"]
+        if not prompt:
+            logger.warning(f"{race_label}: データが取得できませんでした。スキップします。")
+            self._count("skipped")
+            return
+        for c in race["changes"] or []:
+            logger.info(f"{race_label}: 変更 {c['項目']} 馬番{c['馬番']}: {c['変更前']} → {c['変更後']}")
+        result = analyze_race(race, self.stores, year, month, day, place_code, place_name, use_cache=not self.args.force,
+                              previous=previous, ab=self.args.prompt_format == "ab",
+                              on_start=lambda: logger.info(f"{race_label}: AI分析 (入力 約{race['prompt_tokens']} トークン・"
+                                                           f"{race['prompt_format']})"))
+        if result.reused:
+            logger.info(f"{race_label}: 入力データに変更なし (保存済みの回答を使用)")
+            self._count("reused")
+            return
+        stats, answer = result.stats, result.answer
+        if result.failed:
+            logger.error(f"{race_label}: AI分析に失敗しました ({stats.get('error') or '空の回答'}): {answer[:200]}")
+            self._count("failed")
+            return
+        logger.info(f"{race_label}: 分析完了 ({stats.get('seconds', 0):.1f} 秒, 初回応答 {stats.get('ttft') or 0:.1f} 秒, "
+                    f"{stats.get('tokens_per_sec', 0):.0f} トークン/秒, {len(answer)} 文字)")
+        self._count("analyzed")
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    setup_logging(args.log_file)
+    race_pipeline.configure(load_settings(args.secrets), max_concurrent=args.ai_concurrency)
+
+    date_to = args.date_to or args.date_from
+    if date_to < args.date_from:
+        logger.error("--to は --from 以降の日付を指定してください")
+        return 2
+    days = [args.date_from + timedelta(days=i) for i in range((date_to - args.date_from).days + 1)]
+    jobs = [(d, v) for d in days for v in sorted(set(args.venues))]
+    logger.info(f"{len(days)} 日 × {len(set(args.venues))} 場 = {len(jobs)} ジョブ")
+    return 0 if BatchRunner(args).run(jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import json
+import logging
+import random
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from prompt_encoder import estimate_tokens
+
+# ==================================================
+# Dify APIクライアント (keep-alive・同時実行数制限・段階別タイムアウト・リトライ・サーキットブレーカー)
+# ==================================================
+
+logger = logging.getLogger("nar.dify")
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class DifyError(Exception):
+    """ワークフローがエラーを返した (画面には「⚠️」付きで表示)"""
+
+
+class DifyTimeout(DifyError):
+    """最初の応答・次の応答が期限内に来なかった (待ち続けないよう再試行しない)"""
+
+
+class _Watchdog:
+    """期限を過ぎたらレスポンスを閉じて読み込みを中断する (無応答のまま待ち続けない)"""
+
+    def __init__(self, res, seconds: float):
+        self.res = res
+        self.expired = None
+        self._stop = threading.Event()
+        self.reset(seconds, "first_token")
+        threading.Thread(target=self._run, name="dify-watchdog", daemon=True).start()
+
+    def reset(self, seconds: float, phase: str):
+        self.deadline = time.monotonic() + seconds
+        self.phase = phase
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(0.2):
+            if time.monotonic() > self.deadline:
+                self.expired = self.phase
+                # close() だけでは受信待ちが解けないため、ソケットを直接shutdownする
+                sock = getattr(getattr(self.res.raw, "connection", None), "sock", None)
+                try:
+                    if sock is not None: sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self.res.close()
+                return
+
+
+class DifyClient:
+    """ワークフローのストリーミング実行 (プロセス内で共有し、全セッションの同時実行数を制限)"""
+
+    def __init__(self, api_url: str, api_key: str, max_concurrent: int = 3, connect_timeout: float = 5,
+                 first_token_timeout: float = 60, idle_timeout: float = 30, max_retries: int = 3,
+                 max_retry_wait: float = 20, breaker_threshold: int = 3, breaker_cooldown: float = 60,
+                 user: str = "keiba-bot"):
+        self.api_url = api_url.rstrip("/")
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.first_token_timeout = first_token_timeout
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.user = user
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, max_concurrent))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrent))
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0
+
+    def stream(self, text: str, stats: dict | None = None):
+        """回答を断片ごとに返す。stats を渡すと ttft/seconds/tokens_per_sec/attempts を記録
+        (回答の途中で切れた場合は再送せず、末尾に「⚠️」付きのメッセージを返す)"""
+        stats = stats if stats is not None else {}
+        stats.update(ttft=None, seconds=0.0, tokens_per_sec=0.0, attempts=0, bad_lines=0, error=None)
+        if self._breaker_open():
+            stats["error"] = "circuit open"
+            yield "⚠️ Dify APIへの接続を一時停止中です (連続エラーのため)。しばらくしてから再実行してください。"
+            return
+
+        start = time.perf_counter()
+        answer = []
+        try:
+            with self._slots:
+                for attempt in range(self.max_retries + 1):
+                    stats["attempts"] = attempt + 1
+                    try:
+                        for chunk in self._stream_once(text, stats):
+                            if stats["ttft"] is None:
+                                stats["ttft"] = time.perf_counter() - start
+                            answer.append(chunk)
+                            yield chunk
+                        break
+                    except (requests.ConnectionError, _RetryableStatus) as e:
+                        if answer or attempt >= self.max_retries: raise
+                        # 待機中も同時実行枠を占有するため、Retry-After が長くても上限で打ち切る
+                        wait = min(self.max_retry_wait, getattr(e, "retry_after", None)
+                                   or min(20, 2 ** attempt) * (0.5 + random.random()))
+                        logger.warning(f"Dify再試行 ({attempt + 1}/{self.max_retries}, {wait:.1f}秒後): {e}")
+                        time.sleep(wait)
+            self._record(True)
+        except Exception as e:
+            self._record(False)
+            stats["error"] = str(e)
+            yield f"\n\n⚠️ API Error: {e}" if answer else f"⚠️ API Error: {e}"
+        finally:
+            stats["seconds"] = time.perf_counter() - start
+            streamed = stats["seconds"] - (stats["ttft"] or 0)
+            if answer and streamed > 0:
+                stats["tokens_per_sec"] = estimate_tokens("".join(answer)) / streamed
+
+    def close(self):
+        self.session.close()
+
+    # ---------- 内部処理 ----------
+
+    def _stream_once(self, text, stats):
+        payload = {"inputs": {"text": text}, "response_mode": "streaming", "user": self.user}
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        res = self.session.post(f"{self.api_url}/workflows/run", headers=headers, json=payload, stream=True,
+                                # 読み込み待ちの打ち切りは _Watchdog が行う (こちらは予備)
+                                timeout=(self.connect_timeout, max(self.first_token_timeout, self.idle_timeout) + 5))
+        if res.status_code in RETRY_STATUS:
+            res.close()
+            raise _RetryableStatus(res)
+        res.raise_for_status()
+
+        watchdog = _Watchdog(res, self.first_token_timeout)
+        try:
+            answered = False
+            # 届いた分ずつ読む (既定の512バイト単位では短いpingが溜まるまで届かない)
+            # chunked ならチャンク単位、それ以外は終端まで待たないよう1バイトずつ
+            for line in res.iter_lines(chunk_size=None if getattr(res.raw, "chunked", False) else 1):
+                if not line: continue
+                # ping・ノードの進捗などイベントが届いている間は待ち続ける (回答の開始前は first_token の期限)
+                if answered:
+                    watchdog.reset(self.idle_timeout, "idle")
+                else:
+                    watchdog.reset(self.first_token_timeout, "first_token")
+                decoded = line.decode("utf-8")
+                if not decoded.startswith("data:"): continue
+                try:
+                    data = json.loads(decoded[5:].strip())
+                except ValueError:
+                    stats["bad_lines"] += 1
+                    logger.debug(f"Dify: 解析できない行を無視: {decoded[:200]}")
+                    continue
+                if data.get("event") == "error":
+                    raise DifyError(data.get("message") or "workflow error")
+                if "answer" in data:
+                    answered = True
+                    watchdog.reset(self.idle_timeout, "idle")
+                    yield data.get("answer", "")
+        except Exception as e:
+            if watchdog.expired: raise self._timeout(watchdog.expired) from e
+            raise
+        finally:
+            watchdog.stop()
+            res.close()
+        if watchdog.expired: # 中断で読み込みが例外なく終わった場合
+            raise self._timeout(watchdog.expired)
+
+    def _timeout(self, phase):
+        if phase == "first_token":
+            return DifyTimeout(f"回答の開始前に {self.first_token_timeout:g} 秒以上応答が途切れました")
+        return DifyTimeout(f"応答が {self.idle_timeout:g} 秒以上途切れました")
+
+    def _breaker_open(self) -> bool:
+        with self._lock:
+            # クールダウン経過後は1回だけ試行を通す (半開状態)
+            if self._failures >= self.breaker_threshold and time.monotonic() < self._open_until:
+                return True
+            if self._failures >= self.breaker_threshold:
+                self._open_until = time.monotonic() + self.breaker_cooldown
+            return False
+
+    def _record(self, ok: bool):
+        with self._lock:
+            if ok:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self.breaker_threshold:
+                self._open_until = time.monotonic() + self.breaker_cooldown
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, res):
+        super().__init__(f"HTTP {res.status_code}")
+        retry_after = res.headers.get("Retry-After", "")
+        self.retry_after = float(retry_after) if retry_after.isdigit() else None
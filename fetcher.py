@@ -0,0 +1,107 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import get_encodings_from_content
+
+from page_wait import html_ready
+
+# ==================================================
+# HTTP取得レイヤー (ログイン後のページはブラウザを使わず取得)
+# ==================================================
+
+# Bot検知回避のためのUser-Agent (get_driver と揃える)
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+class HttpFetcher:
+    """ブラウザのCookieを引き継ぎ、keep-aliveのSessionでページを取得する"""
+
+    def __init__(self, user_agent: str = DEFAULT_USER_AGENT, pool_size: int = 8, timeout: float = 20,
+                 max_per_host: int = 2, waiter=None, cache=None):
+        self.timeout = timeout
+        # PageWaiter を渡すとページ種別ごとのマーカー有無と所要時間を記録する
+        self.waiter = waiter
+        # PageCache を渡すとTTL内はディスクから返し、期限切れはETag/Last-Modifiedで再検証する
+        self.cache = cache
+        self.cache_stats = {"hits": 0, "revalidated": 0, "misses": 0} # この fetcher での内訳 (PageCache 側は全体の累計)
+        # ホストごとの同時接続数制限 (並列取得時に相手サーバーへ負荷をかけすぎない)
+        self.max_per_host = max(1, max_per_host)
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=2)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "User-Agent": user_agent,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "ja,en-US;q=0.8,en;q=0.6",
+        })
+
+    def import_cookies(self, driver):
+        """Seleniumの現在ドメインのCookieをSessionへコピー (ログイン直後に呼ぶ)"""
+        for c in driver.get_cookies():
+            self.session.cookies.set(
+                c["name"], c["value"],
+                domain=c.get("domain", ""),
+                path=c.get("path", "/"),
+                secure=c.get("secure", False),
+            )
+
+    def get(self, url: str, page: str | None = None, revalidate: bool = False) -> str:
+        """ページのHTMLを文字列で返す (HTTPエラーは例外、revalidate=TrueはTTL内でも再検証)"""
+        start = time.perf_counter()
+        entry = self.cache.lookup(url) if self.cache else None
+        if entry and entry.is_fresh(page) and not revalidate:
+            self.cache.hits += 1
+            self.cache_stats["hits"] += 1
+            html = entry.html
+        else:
+            headers = entry.validators() if entry else {}
+            with self._slot(urlsplit(url).netloc):
+                res = self.session.get(url, headers=headers, timeout=self.timeout)
+            if entry and res.status_code == 304:
+                self.cache.revalidated += 1
+                self.cache_stats["revalidated"] += 1
+                self.cache.touch(url)
+                html = entry.html
+            else:
+                res.raise_for_status()
+                html = decode_html(res)
+                if self.cache:
+                    self.cache.misses += 1
+                    self.cache_stats["misses"] += 1
+                    # ログイン切れ等でマーカーが無いページはキャッシュしない
+                    if not page or html_ready(page, html):
+                        self.cache.store(url, page, html, res.headers.get("ETag"), res.headers.get("Last-Modified"))
+        if page and self.waiter:
+            self.waiter.check_html(page, url, html, time.perf_counter() - start)
+        return html
+
+    def _slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def decode_html(res: requests.Response) -> str:
+    """ヘッダにcharsetが無い場合はmetaタグから判定 (netkeibaはEUC-JP)"""
+    content_type = res.headers.get("Content-Type", "")
+    if "charset=" not in content_type.lower():
+        head = res.content[:2048].decode("ascii", errors="ignore")
+        encodings = get_encodings_from_content(head)
+        res.encoding = encodings[0] if encodings else res.apparent_encoding
+    return res.text
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+# ==================================================
+# 履歴保存 (バックグラウンド・一括upsert・失敗時はローカルジャーナルへ退避)
+# ==================================================
+
+DEFAULT_JOURNAL_PATH = os.path.join(".cache", "history_journal.jsonl")
+
+# Supabase側に (race_id, prompt_hash) のユニーク制約が必要
+#   create unique index history_race_prompt on history (race_id, prompt_hash);
+CONFLICT_KEYS = ("race_id", "prompt_hash")
+
+
+def prompt_hash(prompt: str) -> str:
+    """プロンプト内容のハッシュ (同一入力の再実行を同じ行に集約する)"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class HistoryWriter:
+    """履歴レコードをキューに溜め、別スレッドでまとめてupsertする"""
+
+    def __init__(self, client_factory, table: str = "history", batch_size: int = 12,
+                 flush_interval: float = 2.0, max_retries: int = 4,
+                 journal_path: str = DEFAULT_JOURNAL_PATH):
+        self.client_factory = client_factory
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.journal_path = journal_path
+        self.saved = 0
+        self.journaled = 0
+        self.last_error = None
+        self.upsert_seconds = deque(maxlen=50)
+        self._queue = queue.Queue()
+        self._inflight = [] # 送信中 (リトライ待ちを含む) の (レコード, on_result)
+        self._journal_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: dict, on_result=None):
+        """on_result(ok, error) は送信後 (失敗してジャーナルへ退避した場合は ok=False) に書き込みスレッドから呼ばれる"""
+        self._queue.put((record, on_result))
+
+    def avg_upsert_seconds(self) -> float:
+        return sum(self.upsert_seconds) / len(self.upsert_seconds) if self.upsert_seconds else 0.0
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self, timeout: float = 30) -> bool:
+        """キューが空になるまで待機 (CLIの終了時など)"""
+        done = threading.Event()
+        self._queue.put(done.set)
+        return done.wait(timeout)
+
+    def spill_pending(self) -> int:
+        """未送信のレコード (キュー内と送信中の分) をジャーナルへ退避 (flush が間に合わないまま終了するとき)"""
+        items = list(self._inflight)
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if not callable(item): items.append(item)
+        if items: self._spill([record for record, _ in items])
+        self._notify(items, False, "送信前に終了しました")
+        return len(items)
+
+    def replay_journal(self) -> int:
+        """前回送信できなかったレコードをキューへ戻す (起動時に呼ぶ)
+        再送中のレコードは .replay に移しておき、全件をupsert (失敗分はジャーナルへ再退避) してから削除する
+        (再送中に強制終了しても次回の起動で再送される。送信先が未設定ならジャーナルに残す)"""
+        if self.client_factory() is None: return 0
+        replay_path = self.journal_path + ".replay"
+        with self._journal_lock:
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, encoding="utf-8") as src, open(replay_path, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(self.journal_path)
+            if not os.path.exists(replay_path): return 0
+            with open(replay_path, encoding="utf-8") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        for r in records:
+            self._queue.put((r, None))
+        self._queue.put(lambda: self._replayed(replay_path))
+        return len(records)
+
+    # ---------- 内部処理 ----------
+
+    def _run(self):
+        while True:
+            batch, waiters = self._next_batch()
+            if batch:
+                self._write(batch)
+            for w in waiters:
+                w()
+
+    def _next_batch(self):
+        waiters = []
+        item = self._queue.get()
+        batch = self._inflight = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if callable(item):
+                waiters.append(item)
+                break # flush要求・再送完了の通知: 溜まっている分を即座に書き込んでから呼ぶ
+            batch.append(item)
+            if len(batch) >= self.batch_size: break
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+        return batch, waiters
+
+    def _write(self, batch):
+        # 同一キーはバッチ内で最後のものだけ残す
+        self._inflight = batch
+        rows = list({tuple(r.get(k) for k in CONFLICT_KEYS): r for r, _ in batch}.values())
+        try:
+            ok = self._upsert(rows)
+        finally:
+            self._inflight = []
+        self._notify(batch, ok, None if ok else self.last_error)
+
+    def _upsert(self, rows):
+        for attempt in range(self.max_retries):
+            try:
+                client = self.client_factory()
+                if client is None: break # 送信先が無ければ捨てずにジャーナルへ退避
+                start = time.perf_counter()
+                client.table(self.table).upsert(rows, on_conflict=",".join(CONFLICT_KEYS)).execute()
+                self.upsert_seconds.append(time.perf_counter() - start)
+                self.saved += len(rows)
+                self.last_error = None
+                return True
+            except Exception as e:
+                self.last_error = str(e)
+                time.sleep(min(30, 2 ** attempt) * (0.5 + random.random()))
+        self._spill(rows)
+        return False
+
+    def _notify(self, items, ok, error):
+        for _, on_result in items:
+            if on_result is None: continue
+            try:
+                on_result(ok, error)
+            except Exception:
+                pass
+
+    def _replayed(self, replay_path):
+        with self._journal_lock:
+            if os.path.exists(replay_path):
+                os.remove(replay_path)
+
+    def _spill(self, rows):
+        with self._journal_lock:
+            if os.path.dirname(self.journal_path):
+                os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                for r in rows:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        self.journaled += len(rows)
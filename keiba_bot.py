@@ -1,4 +1,3 @@
-import time
 import json
 import re
 import requests
@@ -8,6 +7,8 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from bs4 import BeautifulSoup
 from supabase import create_client, Client
+from page_wait import PageWaiter
+from lean_browser import lean_options, enable_blocking, page_network_stats
 
 # ==========================================
 # 1. 設定・定数
@@ -37,6 +38,11 @@ MONTH = st.sidebar.text_input("月 (MM)", "12")
 DAY = st.sidebar.text_input("日 (DD)", "26")
 PLACE_CODE = st.sidebar.selectbox("開催場所", ["10", "11", "12", "13"], format_func=lambda x: KB_TO_PLACE_NAME.get(x, x))
 
+# ページ待機 (固定sleepの代わりに準備完了マーカーを待つ)
+waiter = PageWaiter()
+# ページごとのブラウザ通信量 (軽量モードの効果確認用)
+network_log = []
+
 # ==========================================
 # 2. NetKeiba専用関数
 # ==========================================
@@ -49,7 +55,8 @@ def login_netkeiba(driver):
     login_url = "https://regist.netkeiba.com/account/?pid=login"
     try:
         driver.get(login_url)
-        time.sleep(1)
+        waiter.wait_until(driver, "netkeiba_login_form",
+                          lambda d: d.find_elements(By.NAME, "login_id") or "logout" in d.page_source)
 
         if "logout" in driver.page_source:
             st.info("✅ NetKeiba: 既にログイン済みです")
@@ -65,7 +72,9 @@ def login_netkeiba(driver):
             # ログインボタンをクリック（クラス名などは変更される可能性あり）
             submit_btn = driver.find_element(By.CLASS_NAME, "SubmitBtn")
             submit_btn.click()
-            time.sleep(2)
+            if not waiter.wait_until(driver, "netkeiba_login", lambda d: "pid=login" not in d.current_url):
+                st.warning("⚠️ NetKeiba: ログイン後のページに遷移しませんでした（非ログインで継続）")
+                return False
             st.success("✅ NetKeiba: ログイン成功")
             return True
         else:
@@ -99,7 +108,8 @@ def scrape_netkeiba_speed_index(driver, url, current_place_name):
     data = {}
     try:
         driver.get(url)
-        time.sleep(1) # 読み込み待ち
+        waiter.wait_ready(driver, "speed") # 読み込み待ち (テーブル出現まで)
+        network_log.append({"page": "speed", **page_network_stats(driver)})
         
         soup = BeautifulSoup(driver.page_source, "html.parser")
         
@@ -245,7 +255,8 @@ def parse_syutuba_jockey(html_source):
 
 def run_all_races():
     # Chromeオプション設定
-    options = Options()
+    # 画像・フォント・CSS・広告を読み込まない軽量モード (表の取得には不要)
+    options = lean_options(Options())
     options.add_argument('--headless')
     options.add_argument('--no-sandbox')
     options.add_argument('--disable-dev-shm-usage')
@@ -254,6 +265,7 @@ def run_all_races():
     options.add_argument("--window-size=1280,1080")
     
     driver = webdriver.Chrome(options=options)
+    enable_blocking(driver)
 
     try:
         st.markdown("## 🏇 競馬予想データ生成開始")
@@ -285,7 +297,8 @@ def run_all_races():
             kb_url = f"https://s.keibabook.co.jp/chihou/syutuba/{kb_race_id}"
             
             driver.get(kb_url)
-            time.sleep(1)
+            waiter.wait_ready(driver, "syutuba")
+            network_log.append({"page": "syutuba", **page_network_stats(driver)})
             kb_source = driver.page_source
             
             # 既存関数でパース
@@ -350,6 +363,10 @@ def run_all_races():
     finally:
         driver.quit()
         st.success("🎉 全工程完了")
+        with st.expander("⏱ ページ待機ログ"):
+            st.dataframe(waiter.records)
+        with st.expander("📶 ブラウザ通信量"):
+            st.dataframe(network_log)
 
 # ==========================================
 # 5. アプリ起動
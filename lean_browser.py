@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+from selenium.webdriver.chrome.options import Options
+
+# ==================================================
+# 軽量ブラウザ設定 (画像・フォント・CSS を読み込まず、許可したサイト以外には接続しない)
+# ==================================================
+
+# 拡張子で遮断するリソース (表データの取得・ログイン操作には不要)
+# setBlockedURLs はURL全体と照合するため、?v=... 付きのURLにも一致するよう末尾にも * を付ける
+BLOCKED_URL_PATTERNS = [
+    f"*.{ext}*" for ext in ("png", "jpg", "jpeg", "gif", "webp", "svg", "ico", "bmp",
+                            "woff", "woff2", "ttf", "otf", "eot", "css", "mp4", "webm", "mp3")
+]
+
+# 接続を許可するホスト (サブドメインを含む)。それ以外のサードパーティ (広告・計測など) は名前解決させない
+ALLOWED_HOSTS = ["keibabook.co.jp", "netkeiba.com"]
+
+# 通常モード (軽量化なし) で読み込んだときの転送量 (節約量の見積もりの基準、ページ・サイトごと)
+DEFAULT_REFERENCE_PATH = os.path.join(".cache", "browser_reference.json")
+
+
+def host_resolver_rules(allowed_hosts) -> str:
+    """許可ホスト以外を名前解決できなくする Chrome の --host-resolver-rules (IPアドレス直指定は対象外)"""
+    rules = ["MAP * ~NOTFOUND"]
+    for host in allowed_hosts:
+        rules += [f"EXCLUDE {host}", f"EXCLUDE *.{host}"]
+    return ", ".join(rules)
+
+
+def lean_options(options: Options | None = None, allowed_hosts=None) -> Options:
+    """DOM構築完了で制御を返し (eager)、画像の読み込みと許可ホスト以外への接続を無効化したオプション
+    allowed_hosts を省略すると ALLOWED_HOSTS"""
+    options = options or Options()
+    options.add_argument(f"--host-resolver-rules={host_resolver_rules(allowed_hosts or ALLOWED_HOSTS)}")
+    options.page_load_strategy = "eager"
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.fonts": 2,
+    })
+    # 転送量の集計用 (Networkイベントをperformanceログとして取得)
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return options
+
+
+def enable_blocking(driver):
+    """CDPで拡張子の遮断パターンを登録 (ドライバー起動直後に1回呼ぶ)"""
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+
+
+def page_network_stats(driver) -> dict:
+    """前回呼び出し以降の通信量 (リクエスト数・受信バイト数・遮断数) を集計
+    遮断数は拡張子での遮断と、許可ホスト以外への接続 (名前解決の失敗) の合計"""
+    stats = {"requests": 0, "bytes": 0, "blocked": 0, "blocked_hosts": set()}
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return {}
+    urls = {}
+    for entry in entries:
+        try:
+            msg = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        method, params = msg.get("method"), msg.get("params", {})
+        if method == "Network.requestWillBeSent":
+            urls[params.get("requestId")] = params.get("request", {}).get("url", "")
+            stats["requests"] += 1
+        elif method == "Network.loadingFinished":
+            stats["bytes"] += int(params.get("encodedDataLength", 0))
+        elif method == "Network.loadingFailed" and (params.get("blockedReason")
+                                                    or params.get("errorText") == "net::ERR_NAME_NOT_RESOLVED"):
+            stats["blocked"] += 1
+            stats["blocked_hosts"].add(urlsplit(urls.get(params.get("requestId"), "")).hostname or "")
+    stats["blocked_hosts"] = ", ".join(sorted(h for h in stats["blocked_hosts"] if h))
+    return stats
+
+
+class SavingsEstimator:
+    """軽量モードで節約した転送量を、同じページを通常モードで1回読み込んだときの受信バイト数との差で見積もる
+    (遮断したリクエストは転送されずサイズが分からないため、基準との差で求める)"""
+
+    def __init__(self, path: str = DEFAULT_REFERENCE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.reference = json.load(f)
+        except (OSError, ValueError):
+            self.reference = {}
+
+    def annotate(self, key: str, stats: dict, lean: bool) -> dict:
+        """通常モードなら受信バイト数を基準として保存し、軽量モードなら bytes_saved を付けて返す (基準が無ければNone)"""
+        if not stats: return stats
+        with self._lock:
+            if not lean:
+                self.reference[key] = stats["bytes"]
+                self._save()
+                return {**stats, "bytes_saved": None}
+            reference = self.reference.get(key)
+        return {**stats, "bytes_saved": max(0, reference - stats["bytes"]) if reference is not None else None}
+
+    def _save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.reference, f)
@@ -0,0 +1,118 @@
+import gc
+import logging
+import os
+import threading
+import time
+
+# ==================================================
+# メモリ監視 (Python本体とChromeのRSSを定期計測し、上限を超えたらブラウザを破棄)
+# ==================================================
+
+logger = logging.getLogger("nar.memory")
+
+DEFAULT_MEMORY_LIMIT_MB = 1500
+
+
+def process_rss_mb() -> float:
+    """このプロセスのRSS (psutilが無ければ /proc から、どちらも無ければ0)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return 0.0
+
+
+class MemoryGovernor:
+    """RSSを一定間隔で計測し、合計が limit_mb を超えたら on_limit (ブラウザ破棄) とGCを実行する
+    レースごとのピークは、そのレースの処理中 (取得開始〜AI回答完了) に計測した合計RSSの最大値
+    (先読みで並行処理中のレースは同じ計測値を共有する)"""
+
+    def __init__(self, limit_mb: float = DEFAULT_MEMORY_LIMIT_MB, interval: float = 0.5,
+                 browser_mb=lambda: 0.0, on_limit=None, cooldown: float = 30):
+        self.limit_mb = limit_mb
+        self.interval = interval
+        self.browser_mb = browser_mb
+        self.on_limit = on_limit
+        self.cooldown = cooldown
+        self.peak_mb = 0.0
+        self.recycles = 0
+        self._races = {}     # レース番号 -> {"peak_mb", "python_mb", "browser_mb"}
+        self._active = set()
+        self._last_action = 0.0
+        self._lock = threading.Lock()
+        self._halt = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-governor", daemon=True)
+
+    def start(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._halt.set()
+        if self._thread.is_alive(): self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def begin(self, race: int):
+        with self._lock:
+            self._active.add(race)
+            self._races.setdefault(race, {"peak_mb": 0.0, "python_mb": 0.0, "browser_mb": 0.0})
+        self.sample() # 短時間で終わるレースも最低1回は計測する
+
+    def end(self, race: int):
+        self.sample()
+        with self._lock:
+            self._active.discard(race)
+
+    def race_peaks(self) -> list:
+        """レースごとのピーク (画面表示用)"""
+        with self._lock:
+            return [{"race": f"{race}R", **{k: round(v) for k, v in peaks.items()}}
+                    for race, peaks in sorted(self._races.items())]
+
+    def peak_of(self, race: int) -> float:
+        with self._lock:
+            return self._races.get(race, {}).get("peak_mb", 0.0)
+
+    def sample(self) -> float:
+        python_mb = process_rss_mb()
+        try:
+            browser_mb = self.browser_mb()
+        except Exception:
+            browser_mb = 0.0
+        total = python_mb + browser_mb
+        with self._lock:
+            self.peak_mb = max(self.peak_mb, total)
+            for race in self._active:
+                peaks = self._races[race]
+                if total > peaks["peak_mb"]:
+                    peaks.update(peak_mb=total, python_mb=python_mb, browser_mb=browser_mb)
+        if total >= self.limit_mb: self._relieve(total, browser_mb)
+        return total
+
+    # ---------- 内部処理 ----------
+
+    def _run(self):
+        while not self._halt.wait(self.interval):
+            self.sample()
+
+    def _relieve(self, total, browser_mb):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_action < self.cooldown: return
+            self._last_action = now
+        logger.warning(f"メモリ使用量が上限を超えました ({total:.0f} MB / {self.limit_mb:.0f} MB)")
+        if browser_mb > 0 and self.on_limit is not None and self.on_limit():
+            self.recycles += 1
+            logger.warning(f"常駐ブラウザを破棄しました ({browser_mb:.0f} MB、次回のログイン確認時に再起動)")
+        gc.collect()
@@ -0,0 +1,107 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl # 別プロセス (app.py と cli.py) からの同時追記を防ぐ
+except ImportError:
+    fcntl = None
+
+# ==================================================
+# ページアーカイブ (取得したHTMLを日ごとの追記専用gzipファイルに保存し、後から再解析できるようにする)
+# ==================================================
+
+DEFAULT_ARCHIVE_PATH = os.path.join(".cache", "archive")
+DEFAULT_ARCHIVE_MAX_MB = 500
+PRUNE_EVERY_BYTES = 4 * 1024 * 1024 # 容量の確認間隔 (追記量)
+
+
+class PageArchive:
+    """開催日ごとに {YYYYMMDD}.jsonl.gz へ1ページ1行 (gzipメンバー単位) で追記する
+    同じURLで内容が前回と同じページは追記しない (キャッシュから再取得したページ等)
+    合計が max_bytes を超えたら開催日の古いファイルから削除する"""
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH, compresslevel: int = 6,
+                 max_bytes: int = DEFAULT_ARCHIVE_MAX_MB * 1024 * 1024):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.compresslevel = compresslevel
+        self.max_bytes = max_bytes
+        self.appended = 0
+        self.pruned = 0 # 容量上限で削除した日数
+        self._unchecked = PRUNE_EVERY_BYTES # 前回の容量確認からの追記量 (初回の追記で確認する)
+        self._latest = {} # 日付 -> {url: 内容のハッシュ}
+        self._lock = threading.Lock()
+
+    def append(self, day: str, race_id: str, place_code: str, page: str, url: str, html: str) -> bool:
+        """追記したらTrue (内容が前回と同じならFalse)"""
+        digest = hashlib.sha1(html.encode("utf-8")).hexdigest()
+        record = {"race_id": race_id, "place_code": place_code, "page": page, "url": url,
+                  "fetched_at": time.time(), "sha1": digest, "html": html}
+        body = gzip.compress((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"), self.compresslevel)
+        with self._lock:
+            latest = self._latest_of(day)
+            if latest.get(url) == digest: return False
+            with open(self.file_of(day), "ab") as f:
+                if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(body)
+            latest[url] = digest
+            self.appended += 1
+            self._unchecked += len(body)
+            if self._unchecked >= PRUNE_EVERY_BYTES:
+                self._prune(keep=day)
+        return True
+
+    def days(self, date_from: str | None = None, date_to: str | None = None) -> list:
+        """保存済みの開催日 (YYYYMMDD、範囲指定可)"""
+        days = sorted(os.path.basename(p)[:8] for p in glob.glob(os.path.join(self.path, "*.jsonl.gz")))
+        return [d for d in days if (not date_from or d >= date_from) and (not date_to or d <= date_to)]
+
+    def file_of(self, day: str) -> str:
+        return os.path.join(self.path, f"{day}.jsonl.gz")
+
+    def total_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in glob.glob(os.path.join(self.path, "*.jsonl.gz")))
+
+    # ---------- 内部処理 ----------
+
+    def _prune(self, keep):
+        """容量上限を超えたら開催日の古い順にファイルを削除 (追記中の日は残す)"""
+        self._unchecked = 0
+        sizes = {d: os.path.getsize(self.file_of(d)) for d in self.days()}
+        total = sum(sizes.values())
+        for d in sorted(sizes):
+            if total <= self.max_bytes: break
+            if d == keep: continue
+            os.remove(self.file_of(d))
+            self._latest.pop(d, None)
+            total -= sizes[d]
+            self.pruned += 1
+
+    def _latest_of(self, day):
+        if day not in self._latest:
+            self._latest[day] = {r["url"]: r["sha1"] for r in read_day(self.file_of(day))}
+        return self._latest[day]
+
+
+def read_day(path: str):
+    """1日分のレコードを追記順に返す (書き込み途中で切れた末尾は無視)"""
+    if not os.path.exists(path): return
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                yield json.loads(line)
+        except (EOFError, OSError, ValueError):
+            return
+
+
+def latest_pages(records) -> dict:
+    """(race_id, page) ごとに最後に保存された版だけを残す"""
+    latest = {}
+    for r in records:
+        latest[(r["race_id"], r["page"])] = r
+    return latest
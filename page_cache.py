@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# ==================================================
+# ページキャッシュ (URLキー・zlib圧縮HTML・種別ごとのTTL・LRU容量制限)
+# ==================================================
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "pages.sqlite3")
+
+# ページ種別ごとの有効期限 (秒)
+# 日程・過去指数はほぼ変わらない / 談話・出馬表(乗り替わり)は当日よく変わる
+PAGE_TTL = {
+    "schedule": 6 * 3600,
+    "speed": 3 * 3600,
+    "cyokyo": 3600,
+    "danwa": 10 * 60,
+    "syutuba": 5 * 60,
+}
+DEFAULT_TTL = 10 * 60
+
+
+class CacheEntry:
+    def __init__(self, html, etag, last_modified, fetched_at):
+        self.html = html
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, page: str | None, now: float | None = None) -> bool:
+        ttl = PAGE_TTL.get(page, DEFAULT_TTL)
+        return ((now or time.time()) - self.fetched_at) < ttl
+
+    def validators(self) -> dict:
+        """条件付きリクエスト用ヘッダ (ETag / Last-Modified)"""
+        headers = {}
+        if self.etag: headers["If-None-Match"] = self.etag
+        if self.last_modified: headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """SQLiteに保存するスレッドセーフなページキャッシュ"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 200 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, page TEXT, body BLOB, size INTEGER,"
+            " etag TEXT, last_modified TEXT, fetched_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages(accessed_at)")
+        self._conn.commit()
+
+    def lookup(self, url: str) -> CacheEntry | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if not row: return None
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+        body, etag, last_modified, fetched_at = row
+        return CacheEntry(zlib.decompress(body).decode("utf-8"), etag, last_modified, fetched_at)
+
+    def store(self, url: str, page: str | None, html: str, etag: str | None = None, last_modified: str | None = None):
+        body = zlib.compress(html.encode("utf-8"), 6)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, page, body, len(body), etag, last_modified, now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, url: str):
+        """304 Not Modified 時に取得時刻を更新 (TTLを延長)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def _evict(self):
+        """容量上限を超えたら最終アクセスが古い順に削除 (LRU)"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes: return
+        for url, size in self._conn.execute("SELECT url, size FROM pages ORDER BY accessed_at").fetchall():
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes: break
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
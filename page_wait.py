@@ -0,0 +1,81 @@
+import re
+import threading
+import time
+from typing import NamedTuple
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+# ==================================================
+# ページ待機エンジン (固定sleepの代わりに準備完了マーカーを待つ)
+# ==================================================
+
+class ReadyMarker(NamedTuple):
+    css: str            # ブラウザ待機用のCSSセレクタ
+    pattern: str        # HTTP取得したHTMLに含まれるべき目印 (正規表現)
+    timeout: float = 10 # ページごとの最大待機秒数
+
+
+READY_MARKERS = {
+    "schedule": ReadyMarker("a[href*='/chihou/']", r"/chihou/\w+/(?:\d+/)?\d{16}"),
+    "danwa": ReadyMarker("table.danwa", r'class="[^"]*\bdanwa\b'),
+    "syutuba": ReadyMarker("table.syutuba_sp", r'class="[^"]*\bsyutuba_sp\b'),
+    "cyokyo": ReadyMarker("table.cyokyo", r'class="[^"]*\bcyokyo\b'),
+    "speed": ReadyMarker("table.SpeedIndex_Table", r'class="[^"]*\bSpeedIndex_Table\b'),
+}
+_COMPILED = {name: re.compile(m.pattern) for name, m in READY_MARKERS.items()}
+
+
+def html_ready(page: str, html: str) -> bool:
+    """HTML文字列に準備完了マーカーが含まれるか (未知の種別はTrue)"""
+    return bool(_COMPILED[page].search(html)) if page in _COMPILED else True
+
+
+class PageWaiter:
+    """ページごとの待機結果 (所要秒数・成否) を記録しながら待機する"""
+
+    def __init__(self, poll: float = 0.1):
+        self.poll = poll
+        self.records = []
+        self._lock = threading.Lock()
+
+    def wait_ready(self, driver, page: str, timeout: float | None = None) -> bool:
+        """マーカー要素が現れるまで待機 (タイムアウト時はFalse)"""
+        marker = READY_MARKERS[page]
+        return self.wait_until(
+            driver, page,
+            lambda d: d.find_elements(By.CSS_SELECTOR, marker.css),
+            timeout or marker.timeout,
+        )
+
+    def wait_until(self, driver, page: str, condition, timeout: float = 10) -> bool:
+        """任意の条件 (例: ログイン後のリダイレクト) が満たされるまで待機"""
+        start = time.perf_counter()
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=self.poll).until(condition)
+            ready = True
+        except TimeoutException:
+            ready = False
+        self._record(page, driver.current_url, time.perf_counter() - start, ready)
+        return ready
+
+    def check_html(self, page: str, url: str, html: str, seconds: float) -> bool:
+        """HTTP取得したHTMLにマーカーがあるか確認して記録"""
+        ready = html_ready(page, html)
+        self._record(page, url, seconds, ready)
+        return ready
+
+    def not_ready(self):
+        return [r for r in self.records if not r["ready"]]
+
+    def missing_pages(self, urls) -> list:
+        """urls のうち最後の取得でマーカーが無かったページの種別 (取り直して揃ったものは除く)"""
+        urls = set(urls)
+        with self._lock:
+            latest = {r["url"]: r for r in self.records if r["url"] in urls}
+        return [r["page"] for r in latest.values() if not r["ready"]]
+
+    def _record(self, page, url, seconds, ready):
+        with self._lock:
+            self.records.append({"page": page, "url": url, "seconds": round(seconds, 3), "ready": ready})
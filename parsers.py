@@ -0,0 +1,232 @@
+import re
+from contextlib import contextmanager
+from bs4 import BeautifulSoup, SoupStrainer
+
+# ==================================================
+# HTML解析レイヤー (1ページ1ツリー・高速パーサー・必要なテーブルのみ部分解析)
+# ==================================================
+
+# lxmlがあれば使用 (html.parserより数倍速い)
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# ページ種別ごとに解析対象を絞る (該当要素とその子孫だけをツリー化)
+STRAINERS = {
+    "danwa": SoupStrainer(class_=["racetitle", "danwa"]),
+    "syutuba": SoupStrainer("table", class_="syutuba_sp"),
+    "cyokyo": SoupStrainer("table", class_="cyokyo"),
+    "speed": SoupStrainer(class_=["RaceData01", "SpeedIndex_Table"]),
+    "schedule": SoupStrainer("a", href=True),
+}
+
+
+def make_soup(html: str, page: str | None = None) -> BeautifulSoup:
+    """ページ種別に応じた部分解析ツリーを作成"""
+    return BeautifulSoup(html, PARSER, parse_only=STRAINERS.get(page))
+
+
+@contextmanager
+def parsed(html: str, page: str | None = None):
+    """解析ツリーを抽出後すぐに破棄する (ツリーは循環参照のため、del だけでは次のGCまで残る)"""
+    soup = make_soup(html, page)
+    try:
+        yield soup
+    finally:
+        soup.decompose()
+
+
+def _as_soup(doc, page):
+    # 既存の呼び出し (HTML文字列渡し) も受け付ける
+    return doc if isinstance(doc, BeautifulSoup) else make_soup(doc, page)
+
+
+# ==================================================
+# 競馬ブック
+# ==================================================
+
+def parse_schedule_index(doc):
+    """日程ページ1枚から 場所コード → レース一覧 (race_id, race_num, post_time) を作成"""
+    soup = _as_soup(doc, "schedule")
+    index = {}
+    seen = set()
+
+    # リンクからID抽出 (IDの7-8文字目が場所コード、11-12文字目がレース番号)
+    for a in soup.find_all("a", href=True):
+        match = re.search(r'(\d{16})', a['href'])
+        if not match: continue
+        rid = match.group(1)
+        if rid in seen: continue
+        seen.add(rid)
+        # 発走時刻はリンク文字列にあれば取得 (例: "1R 14:50")
+        time_match = re.search(r'(\d{1,2})[:：](\d{2})', a.get_text(" ", strip=True))
+        post_time = f"{int(time_match.group(1)):02d}:{time_match.group(2)}" if time_match else None
+        index.setdefault(rid[6:8], []).append({"race_id": rid, "race_num": int(rid[10:12]), "post_time": post_time})
+    for races in index.values():
+        races.sort(key=lambda r: r["race_id"])
+    return index
+
+def parse_race_info(doc):
+    """レース名・条件などを取得"""
+    soup = _as_soup(doc, "danwa")
+    racetitle = soup.find("div", class_="racetitle")
+    if not racetitle: return {}
+
+    racemei = racetitle.find("div", class_="racemei")
+    race_name = racemei.find_all("p")[1].get_text(strip=True) if racemei and len(racemei.find_all("p")) >= 2 else ""
+
+    sub = racetitle.find("div", class_="racetitle_sub")
+    cond = sub.find_all("p")[1].get_text(" ", strip=True) if sub and len(sub.find_all("p")) >= 2 else ""
+    return {"race_name": race_name, "cond": cond}
+
+def parse_danwa_comments(doc):
+    """談話を取得"""
+    soup = _as_soup(doc, "danwa")
+    danwa_dict = {}
+    table = soup.find("table", class_="danwa")
+    if table and table.tbody:
+        current_uma = None
+        for row in table.tbody.find_all("tr"):
+            uma_td = row.find("td", class_="umaban")
+            if uma_td:
+                current_uma = uma_td.get_text(strip=True)
+                continue
+            txt_td = row.find("td", class_="danwa")
+            if txt_td and current_uma:
+                danwa_dict[current_uma] = txt_td.get_text(strip=True)
+                current_uma = None
+    return danwa_dict
+
+def parse_syutuba_jockey(doc):
+    """出馬表から騎手・乗り替わり情報を取得"""
+    soup = _as_soup(doc, "syutuba")
+    jockey_info = {}
+    table = soup.find("table", class_="syutuba_sp")
+    if not table or not table.find("tbody"): return {}
+
+    for row in table.find("tbody").find_all("tr"):
+        tds = row.find_all("td")
+        if not tds: continue
+
+        # 1列目が馬番
+        umaban_text = tds[0].get_text(strip=True)
+        if not umaban_text.isdigit(): continue
+        umaban = umaban_text
+
+        # 騎手情報
+        kisyu_p = row.find("p", class_="kisyu")
+        if kisyu_p and kisyu_p.find("a"):
+            anchor = kisyu_p.find("a")
+            name = anchor.get_text(strip=True)
+            is_change = bool(anchor.find("strong"))
+            jockey_info[umaban] = {"name": name, "is_change": is_change}
+
+    return jockey_info
+
+def parse_cyokyo(doc):
+    """調教データを取得"""
+    soup = _as_soup(doc, "cyokyo")
+    cyokyo_dict = {}
+    tables = soup.find_all("table", class_="cyokyo")
+    for tbl in tables:
+        tbody = tbl.find("tbody")
+        if not tbody: continue
+        rows = tbody.find_all("tr", recursive=False)
+        if not rows: continue
+
+        h_row = rows[0]
+        uma_td = h_row.find("td", class_="umaban")
+        name_td = h_row.find("td", class_="kbamei")
+        if not uma_td or not name_td: continue
+
+        umaban = uma_td.get_text(strip=True)
+        bamei = name_td.get_text(" ", strip=True)
+        tanpyo = h_row.find("td", class_="tanpyo").get_text(strip=True) if h_row.find("td", class_="tanpyo") else ""
+        detail = rows[1].get_text(" ", strip=True) if len(rows) > 1 else ""
+
+        cyokyo_dict[umaban] = f"【馬名】{bamei} 【短評】{tanpyo} 【詳細】{detail}"
+    return cyokyo_dict
+
+# ==================================================
+# Netkeiba
+# ==================================================
+
+def parse_speed_index(doc, current_place_name):
+    """タイム指数ページ(speed.html)から近5走の指数を取得 (同条件などの集計は speed_analytics で行う)"""
+    soup = _as_soup(doc, "speed")
+    data = {}
+
+    # 現在のレース条件 (例: "大井ダ1400")
+    current_condition = ""
+    race_data_div = soup.find("div", class_="RaceData01")
+    if race_data_div:
+        text = race_data_div.get_text()
+        dist_match = re.search(r'(\d{3,4})m', text)
+        if dist_match:
+            track_type = "芝" if "芝" in text else "ダ"
+            current_condition = f"{current_place_name}{track_type}{dist_match.group(1)}"
+
+    table = soup.find("table", class_="SpeedIndex_Table")
+    if not table: return {}
+
+    rows = table.find_all("tr", class_="HorseList")
+    for row in rows:
+        try:
+            # 馬番
+            umaban_td = row.find("td", class_=re.compile("umaban", re.I))
+            if not umaban_td: continue
+            umaban = umaban_td.get_text(strip=True)
+
+            # 指数データの開始列特定
+            cols = row.find_all("td")
+            start_idx = -1
+            for i, col in enumerate(cols):
+                if "Horse_Name" in " ".join(col.get("class", [])):
+                    start_idx = i + 1
+                    horse = col.get_text(strip=True)
+                    break
+            if start_idx == -1: continue
+
+            # 近5走データ取得 (start_idx+1 から 5つ分、[5走前][4走前][3走前][2走前][前走] の古い順)
+            target_cols = cols[start_idx+1 : start_idx+6]
+            past_list = []
+            runs = []
+
+            for i, td in enumerate(target_cols):
+                run_no = len(target_cols) - 1 - i # 前走が0
+                course_span = td.find("span")
+                if not course_span: continue
+                course_str = course_span.get_text(strip=True)
+
+                idx_a = td.find("a")
+                idx_val = idx_a.get_text(strip=True) if idx_a else "-"
+
+                if idx_val.isdigit():
+                    past_list.append(f"{course_str}({idx_val})")
+                    runs.append({"run_no": run_no, "course": course_str, "speed_index": int(idx_val),
+                                 "run_date": _run_date(td.get_text(" ", strip=True))})
+
+            data[umaban] = {
+                "past": " / ".join(past_list) if past_list else "なし",
+                "condition": current_condition,
+                "horse": horse,
+                "runs": runs, # 構造化した近走 (run_no=0が前走)
+            }
+        except: continue
+
+    return data
+
+
+def _run_date(text):
+    """近走セルの日付 (例: 2025.12.26) を YYYY-MM-DD で返す (無ければ空文字)"""
+    m = re.search(r'(\d{4})[./-](\d{1,2})[./-](\d{1,2})', text)
+    return f"{m.group(1)}-{int(m.group(2)):02d}-{int(m.group(3)):02d}" if m else ""
+
+
+def parse_course(course_str):
+    """コース文字列 (例: "大井ダ1400") を 競馬場・馬場・距離 に分解"""
+    m = re.search(r'(\D*?)(芝|ダ|障)(\d{3,4})', course_str)
+    if not m: return {"venue": "", "surface": "", "distance": None}
+    return {"venue": m.group(1).strip(), "surface": m.group(2), "distance": int(m.group(3))}
@@ -0,0 +1,12 @@
+# ==================================================
+# 開催場所の定数 (画面表示用に重い依存なしで読み込めるよう分離)
+# ==================================================
+
+# 場所コード変換マップ (競馬ブック -> Netkeiba)
+KB_TO_NK_CODE = {
+    "10": "44", # 大井
+    "11": "45", # 川崎
+    "12": "43", # 船橋
+    "13": "42"  # 浦和
+}
+PLACE_NAMES = {"10": "大井", "11": "川崎", "12": "船橋", "13": "浦和"}
@@ -0,0 +1,99 @@
+import hashlib
+import re
+
+# ==================================================
+# コンパクトなプロンプト (表形式・空欄省略・レースごとのトークン上限)
+# ==================================================
+
+DEFAULT_TOKEN_BUDGET = 2500
+PROMPT_FORMATS = ("compact", "verbose", "ab") # ab: レースごとに compact/verbose を振り分けて比較
+
+COLUMNS = "馬番|馬名|騎手(*=乗替)|同条件指数 最高/平均/走数|近走加重|距離帯最高|指数順位|近走(コース:指数)|談話|調教(短評/詳細)"
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算 (日本語は1文字≒1トークン、英数字・記号は4文字≒1トークン)"""
+    if not text: return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def fmt_index(value):
+    """指数の表示 (整数なら小数点なし、欠損は -)"""
+    if value is None: return "-"
+    return f"{value:.0f}" if float(value).is_integer() else f"{value:.1f}"
+
+
+def choose_format(race_id: str, mode: str) -> str:
+    """ab モードはレースIDのハッシュで振り分け (再実行しても同じレースは同じ形式)"""
+    if mode != "ab": return mode
+    return "compact" if int(hashlib.sha256(race_id.encode()).hexdigest(), 16) % 2 else "verbose"
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def _cyokyo_brief(text: str):
+    """parse_cyokyo の「【馬名】…【短評】…【詳細】…」を (馬名, 短評/詳細) に分解"""
+    m = re.match(r"【馬名】(.*?) 【短評】(.*?) 【詳細】(.*)", text or "")
+    if not m: return "", _clean(text)
+    return _clean(m.group(1)), "/".join(p for p in (_clean(m.group(2)), _clean(m.group(3))) if p)
+
+
+def _truncate(text: str, max_tokens: float) -> str:
+    if estimate_tokens(text) <= max_tokens: return text
+    out, used = [], 0.0
+    for ch in text:
+        used += 0.25 if ord(ch) < 128 else 1
+        if used > max_tokens - 1: break
+        out.append(ch)
+    return "".join(out) + "…" if out else ""
+
+
+def _fit(texts, budget):
+    """長文の合計が budget トークンに収まるよう、長いものから同じ上限で切り詰める"""
+    lengths = [estimate_tokens(t) for t in texts]
+    if sum(lengths) <= budget: return texts
+    if budget <= 0: return ["" for _ in texts]
+    lo, hi = 0, max(lengths)
+    while lo < hi: # 上限 cap を二分探索 (sum(min(len, cap)) <= budget となる最大値)
+        cap = (lo + hi + 1) // 2
+        if sum(min(n, cap) for n in lengths) <= budget: lo = cap
+        else: hi = cap - 1
+    return [_truncate(t, lo) for t in texts]
+
+
+def encode_compact(race_meta, danwa_dict, jockey_dict, cyokyo_dict, nk_data, scores=None,
+                   token_budget: int = DEFAULT_TOKEN_BUDGET):
+    """build_prompt と同じ入力から表形式のプロンプトを作成 (データが無ければNone)"""
+    scores = scores or {}
+    all_uma = sorted(set(jockey_dict) | set(nk_data), key=lambda x: int(x) if x.isdigit() else 999)
+    if not all_uma: return None
+    condition = next((v.get("condition") for v in nk_data.values() if v.get("condition")), "")
+
+    rows, texts = [], []
+    for uma in all_uma:
+        j = jockey_dict.get(uma, {})
+        nk = nk_data.get(uma, {})
+        sc = scores.get(uma, {})
+        horse, cyokyo = _cyokyo_brief(cyokyo_dict.get(uma, ""))
+        same = f"{fmt_index(sc['same_max'])}/{fmt_index(sc['same_mean'])}/{sc['same_n']}" if sc.get("same_n") else ""
+        runs = " ".join(f"{r['course']}:{r['speed_index']}" for r in nk.get("runs", []))
+        rows.append([uma, nk.get("horse") or horse, j.get("name", "") + ("*" if j.get("is_change") else ""), same,
+                     fmt_index(sc.get("weighted")) if sc else "", fmt_index(sc.get("band_max")) if sc else "",
+                     fmt_index(sc.get("rank")) if sc else "", runs])
+        texts += [_clean(danwa_dict.get(uma, "")), cyokyo]
+
+    header = (
+        f"レース: {race_meta.get('race_name', '')} {race_meta.get('cond', '')}"
+        + (f" (指数の同条件={condition}、距離帯=同馬場±200m)" if condition else "") + "\n"
+        "各馬のデータから推奨馬を分析してください。「同条件指数」(絶対スピード指数)が高い馬と乗り替わり(*)を重視すること。"
+        "空欄はデータなし。\n"
+        f"{COLUMNS}\n"
+    )
+    # 談話・調教以外を先に確保し、残りのトークンを長文に割り当てる
+    fixed = estimate_tokens(header) + sum(estimate_tokens("|".join(r)) + 3 for r in rows)
+    texts = _fit(texts, token_budget - fixed)
+    lines = ["|".join(r + texts[2 * i: 2 * i + 2]).rstrip("|") for i, r in enumerate(rows)]
+    return header + "\n".join(lines)
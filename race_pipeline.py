@@ -0,0 +1,571 @@
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, fields
+from typing import Any, NamedTuple
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.chrome.options import Options
+from supabase import create_client, Client
+
+from fetcher import DEFAULT_USER_AGENT
+from dify_client import DifyClient
+from page_cache import PAGE_TTL
+from lean_browser import lean_options, enable_blocking
+from history_writer import prompt_hash
+from answer_cache import is_cacheable_answer
+from session_manager import SiteLogin, cookie_domain
+from timing import NULL_TIMELINE
+from speed_analytics import score_field, score_summary
+from race_snapshot import snapshot, fingerprint, diff_snapshots
+from prompt_encoder import DEFAULT_TOKEN_BUDGET, choose_format, encode_compact, estimate_tokens, fmt_index
+from places import KB_TO_NK_CODE
+from parsers import (parsed, parse_schedule_index, parse_race_info, parse_danwa_comments,
+                     parse_syutuba_jockey, parse_cyokyo, parse_speed_index)
+
+# Streamlitに依存しない処理本体 (app.py と cli.py から共通で使用)
+# メッセージは logging で出力し、表示方法は呼び出し側が決める
+logger = logging.getLogger("nar")
+
+# ==================================================
+# 1. 設定・定数
+# ==================================================
+
+@dataclass(frozen=True)
+class Config:
+    """認証情報と接続先 (キー名は secrets.toml / 環境変数と同じ大文字)"""
+    KEIBA_ID: str = ""
+    KEIBA_PASS: str = ""
+    NETKEIBA_EMAIL: str = ""
+    NETKEIBA_PASS: str = ""
+    DIFY_API_KEY: str = ""
+    SUPABASE_URL: str = ""
+    SUPABASE_ANON_KEY: str = ""
+    # 接続先 (ベンチマーク時はローカルのスタンドインサーバーに差し替え)
+    KEIBABOOK_URL: str = "https://s.keibabook.co.jp"
+    NETKEIBA_NAR_URL: str = "https://nar.netkeiba.com"
+    NETKEIBA_REGIST_URL: str = "https://regist.netkeiba.com"
+    DIFY_API_URL: str = "https://api.dify.ai/v1"
+    # Difyの待ち時間 (秒、未設定なら DifyClient の既定値。上流ノードが遅いワークフローでは長めにする)
+    DIFY_FIRST_TOKEN_TIMEOUT: str = ""
+    DIFY_IDLE_TIMEOUT: str = ""
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """st.secrets や os.environ から読み込む (未設定は既定値)"""
+        return cls(**{f.name: str(mapping[f.name]) for f in fields(cls) if mapping.get(f.name)})
+
+
+CONFIG = Config()
+
+def configure(mapping, **dify_options) -> Config:
+    """モジュール全体の設定を差し替える (起動時に1回呼ぶ)
+    dify_options は DifyClient の引数 (max_concurrent, first_token_timeout など)"""
+    global CONFIG, _dify_client
+    config = Config.from_mapping(mapping)
+    with _dify_guard:
+        if config != CONFIG or dify_options != _dify_options:
+            _dify_client = None # 接続先・設定が変わったら作り直す
+            _dify_options.clear()
+            _dify_options.update(dify_options)
+        CONFIG = config
+    return CONFIG
+
+# ==================================================
+# 2. ヘルパー関数 (Supabase, Driver)
+# ==================================================
+
+def create_supabase_client() -> Client | None:
+    if not CONFIG.SUPABASE_URL or not CONFIG.SUPABASE_ANON_KEY: return None
+    return create_client(CONFIG.SUPABASE_URL, CONFIG.SUPABASE_ANON_KEY)
+
+def history_record(year, place_code, place_name, month, day, race_num_str, race_id, ai_answer, prompt="", timings=None,
+                   prompt_format=None):
+    """history テーブルに保存する1行を作成"""
+    data = {
+        "year": str(year),
+        "place_code": str(place_code),
+        "place_name": place_name,
+        "day": str(day),
+        "month": str(month),
+        "race_num": race_num_str,
+        "race_id": race_id,
+        "output_text": ai_answer,
+        "prompt_hash": prompt_hash(prompt),
+    }
+    # 計測結果も保存する場合 (history に jsonb 列 timings が必要)
+    if timings is not None:
+        data["timings"] = timings
+    # A/B比較時のプロンプト形式 (history に text 列 prompt_format が必要)
+    if prompt_format is not None:
+        data["prompt_format"] = prompt_format
+    return data
+
+def lookup_cached_answer(prompt, answer_cache, supabase):
+    """同一プロンプトの過去回答を検索 (ローカル → Supabase history の順)"""
+    key = prompt_hash(prompt)
+    answer = answer_cache.get(key)
+    if answer is not None: return answer
+    if not supabase: return None
+    try:
+        res = supabase.table("history").select("race_id, output_text").eq("prompt_hash", key).limit(1).execute()
+    except Exception:
+        return None
+    if not res.data: return None
+    answer = res.data[0]["output_text"]
+    answer_cache.put(key, res.data[0]["race_id"], answer)
+    return answer
+
+def get_driver(lean: bool = True):
+    """Seleniumドライバーの起動設定 (lean: 画像・フォント・CSS と、ログイン先以外のサイトを読み込まない)"""
+    # ログイン先 (設定で差し替え可能) のホストだけ接続を許可
+    allowed = {cookie_domain(url) for url in (CONFIG.KEIBABOOK_URL, CONFIG.NETKEIBA_NAR_URL, CONFIG.NETKEIBA_REGIST_URL)}
+    options = lean_options(allowed_hosts=sorted(allowed)) if lean else Options()
+    options.add_argument("--headless") # ヘッドレスモード
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--window-size=1280,1080")
+    # Bot検知回避のためのUser-Agent
+    options.add_argument(f"user-agent={DEFAULT_USER_AGENT}")
+    driver = webdriver.Chrome(options=options)
+    if lean:
+        enable_blocking(driver)
+    return driver
+
+def site_logins():
+    """SessionManager に渡すログイン手順 (ID/PASS未設定のサイトは無効)"""
+    return [
+        # 競馬ブックはログイン状態を示す目印が不明なため、談話・調教ページの取得結果でログイン切れを判定する
+        SiteLogin("keibabook", login_keibabook, f"{CONFIG.KEIBABOOK_URL}/login/login",
+                  cookie_domain(CONFIG.KEIBABOOK_URL), marker=None,
+                  enabled=bool(CONFIG.KEIBA_ID and CONFIG.KEIBA_PASS), pages=("danwa", "cyokyo")),
+        SiteLogin("netkeiba", login_netkeiba, f"{CONFIG.NETKEIBA_REGIST_URL}/account/?pid=login",
+                  cookie_domain(CONFIG.NETKEIBA_REGIST_URL),
+                  enabled=bool(CONFIG.NETKEIBA_EMAIL and CONFIG.NETKEIBA_PASS), pages=("speed",)),
+    ]
+
+# ==================================================
+# 3. 競馬ブック スクレイピング関数
+# ==================================================
+
+def login_keibabook(driver, waiter):
+    if not CONFIG.KEIBA_ID or not CONFIG.KEIBA_PASS:
+        logger.warning("⚠️ 競馬ブックのID/PASSが設定されていません。")
+        return False
+    try:
+        driver.get(f"{CONFIG.KEIBABOOK_URL}/login/login")
+        # 要素が見つかるまで待機
+        WebDriverWait(driver, 10).until(EC.visibility_of_element_located((By.NAME, "login_id"))).send_keys(CONFIG.KEIBA_ID)
+        driver.find_element(By.CSS_SELECTOR, "input[type='password']").send_keys(CONFIG.KEIBA_PASS)
+        driver.find_element(By.CSS_SELECTOR, "input[type='submit']").click()
+        # ログイン後のリダイレクト (URLから /login が消える) を待機
+        if not waiter.wait_until(driver, "keibabook_login", lambda d: "/login" not in d.current_url):
+            logger.error("競馬ブック ログインエラー: ログイン後のページに遷移しませんでした")
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"競馬ブック ログインエラー: {e}")
+        return False
+
+# 日程インデックス (日程ページURL(日付) → 場所コード → レース一覧) はプロセス内で共有し、全競馬場・全セッションで使い回す
+_schedule_index = {}
+_schedule_locks = {}
+_schedule_guard = threading.Lock()
+
+def fetch_schedule_index(fetcher, year, month, day):
+    """日程ページを日付ごとに1回だけ取得・解析 (レースが無い日はキャッシュしない)"""
+    url = f"{CONFIG.KEIBABOOK_URL}/chihou/nittei/{year}{month}{day}10" # 末尾10は地方トップ固定
+    with _schedule_guard:
+        lock = _schedule_locks.setdefault(url, threading.Lock())
+    with lock:
+        cached = _schedule_index.get(url)
+        if cached and time.monotonic() - cached[0] < PAGE_TTL["schedule"]:
+            return cached[1]
+        logger.info(f"📅 日程取得中: {url}")
+        with parsed(fetcher.get(url, "schedule"), "schedule") as soup:
+            index = parse_schedule_index(soup)
+        if index:
+            _schedule_index[url] = (time.monotonic(), index)
+        return index
+
+def fetch_race_ids_from_schedule(fetcher, year, month, day, target_place_code):
+    """日程ページから対象競馬場の全レースIDを取得"""
+    return [r["race_id"] for r in fetch_schedule_index(fetcher, year, month, day).get(target_place_code, [])]
+
+def post_times(fetcher, year, month, day, target_place_code):
+    """レースID → 発走時刻 (日程ページに無ければ含まない)"""
+    return {r["race_id"]: r["post_time"] for r in fetch_schedule_index(fetcher, year, month, day).get(target_place_code, [])
+            if r["post_time"]}
+
+# ==================================================
+# 4. Netkeiba スクレイピング関数 (修正版)
+# ==================================================
+
+def login_netkeiba(driver, waiter):
+    """Netkeibaにログイン（修正版）"""
+    if not CONFIG.NETKEIBA_EMAIL or not CONFIG.NETKEIBA_PASS:
+        logger.warning("⚠️ Netkeibaのログイン情報がありません。")
+        return False
+    try:
+        login_url = f"{CONFIG.NETKEIBA_REGIST_URL}/account/?pid=login"
+        driver.get(login_url)
+
+        # ページ読み込み待機 (ログインフォーム or ログイン済み表示、最大10秒)
+        wait = WebDriverWait(driver, 10)
+        waiter.wait_until(driver, "netkeiba_login_form",
+                          lambda d: d.find_elements(By.NAME, "login_id") or "logout" in d.page_source)
+
+        # ログインフォームが表示されるか確認
+        if "logout" in driver.page_source:
+            logger.info("✅ Netkeiba: 既にログイン済み")
+            return True
+
+        # ID入力待機
+        login_id_input = wait.until(EC.visibility_of_element_located((By.NAME, "login_id")))
+        login_id_input.clear()
+        login_id_input.send_keys(CONFIG.NETKEIBA_EMAIL)
+
+        # パスワード入力
+        password_input = driver.find_element(By.NAME, "pswd")
+        password_input.clear()
+        password_input.send_keys(CONFIG.NETKEIBA_PASS)
+
+        # ★修正ポイント: ボタンを探さず、フォームをsubmitする
+        password_input.submit()
+
+        # 遷移待ち (ログインページから離れるまで)
+        if not waiter.wait_until(driver, "netkeiba_login", lambda d: "pid=login" not in d.current_url):
+            logger.error("Netkeiba ログインエラー: ログイン後のページに遷移しませんでした")
+            return False
+        return True
+
+    except Exception as e:
+        logger.error(f"Netkeiba ログインエラー: {e}")
+        return False
+
+def get_netkeiba_speed_url(year, month, day, kb_place_code, race_num):
+    """Netkeibaのタイム指数URL生成"""
+    nk_place = KB_TO_NK_CODE.get(kb_place_code)
+    if not nk_place: return None
+    date_str = f"{month.zfill(2)}{day.zfill(2)}"
+    race_str = str(race_num).zfill(2)
+    # ID構成: YYYY + NK場所コード + MMDD + RR
+    race_id = f"{year}{nk_place}{date_str}{race_str}"
+    return f"{CONFIG.NETKEIBA_NAR_URL}/race/speed.html?race_id={race_id}&type=shutuba&mode=past"
+
+def scrape_netkeiba_speed_index(fetcher, url, current_place_name, timeline=NULL_TIMELINE, race=None, on_page=None):
+    """タイム指数ページからデータを取得 (on_page(page, url, html) は取得したHTMLの保存用)"""
+    try:
+        with timeline.span("fetch.speed", race):
+            html = _get(fetcher, url, "speed", on_page)
+        with timeline.span("parse.speed", race):
+            with parsed(html, "speed") as soup:
+                return parse_speed_index(soup, current_place_name)
+    except Exception as e:
+        return {} # エラー時は空データを返す
+
+# ==================================================
+# 5. Dify API連携 (ストリーミング)
+# ==================================================
+
+_dify_client = None
+_dify_options = {}
+_dify_guard = threading.Lock()
+
+def get_dify_client() -> DifyClient:
+    """プロセス内で共有するDifyクライアント (全セッション・全ジョブで同時実行数を共有)"""
+    global _dify_client
+    with _dify_guard:
+        if _dify_client is None:
+            timeouts = {"first_token_timeout": CONFIG.DIFY_FIRST_TOKEN_TIMEOUT, "idle_timeout": CONFIG.DIFY_IDLE_TIMEOUT}
+            options = {**{k: float(v) for k, v in timeouts.items() if v}, **_dify_options}
+            _dify_client = DifyClient(CONFIG.DIFY_API_URL, CONFIG.DIFY_API_KEY, **options)
+        return _dify_client
+
+def stream_dify_workflow(full_text: str, stats: dict | None = None):
+    """回答を断片ごとに返す (stats に ttft/tokens_per_sec などを記録)"""
+    if not CONFIG.DIFY_API_KEY:
+        if stats is not None: stats["error"] = "DIFY_API_KEY未設定"
+        yield "⚠️ DIFY_API_KEY未設定"
+        return
+    yield from get_dify_client().stream(full_text, stats)
+
+# ==================================================
+# 6. レースデータ収集・プロンプト作成
+# ==================================================
+
+def _get(fetcher, url, page, on_page=None, revalidate=False):
+    html = fetcher.get(url, page, revalidate=revalidate)
+    if on_page is not None:
+        try:
+            on_page(page, url, html)
+        except Exception as e:
+            logger.warning(f"ページのアーカイブに失敗しました: {e}")
+    return html
+
+def collect_race_data(fetcher, race_id, year, month, day, place_code, place_name, timeline=NULL_TIMELINE,
+                      speed_store=None, previous=None, prompt_format="compact", token_budget=DEFAULT_TOKEN_BUDGET,
+                      archive=None):
+    """1レース分のページを取得・解析してプロンプトまで作成 (ワーカースレッドからも呼ばれる)
+    previous (SnapshotStore.get の結果) を渡すとリフレッシュ扱い: 当日変わりうる談話・出馬表だけを
+    キャッシュを再検証して取得し、調教・指数は前回の値を使う
+    prompt_format: "compact" (表形式・token_budget以内) / "verbose" (従来形式) / "ab" (レースごとに振り分け)
+    archive (PageArchive) を渡すと取得したページを開催日ごとに保存する (replay.py で再解析用)"""
+    race_num = int(race_id[10:12]) # IDの11,12桁目がレース番号
+    on_page = None
+    if archive is not None:
+        on_page = lambda page, url, html: archive.append(f"{year}{month.zfill(2)}{day.zfill(2)}", race_id, place_code,
+                                                         page, url, html)
+    prompt_format = choose_format(race_id, prompt_format)
+    refresh = previous is not None
+    urls = [
+        f"{CONFIG.KEIBABOOK_URL}/chihou/danwa/1/{race_id}",
+        f"{CONFIG.KEIBABOOK_URL}/chihou/syutuba/{race_id}",
+    ]
+    
+    # A. 競馬ブック情報 (談話・騎手・調教) ※各ページ1回だけ解析し、同じツリーから抽出して即破棄
+    with timeline.span("fetch.danwa", race_num):
+        html = _get(fetcher, urls[0], "danwa", on_page, revalidate=refresh)
+    with timeline.span("parse.danwa", race_num), parsed(html, "danwa") as soup:
+        race_meta = parse_race_info(soup)
+        danwa_dict = parse_danwa_comments(soup)
+    
+    with timeline.span("fetch.syutuba", race_num):
+        html = _get(fetcher, urls[1], "syutuba", on_page, revalidate=refresh)
+    with timeline.span("parse.syutuba", race_num), parsed(html, "syutuba") as soup:
+        jockey_dict = parse_syutuba_jockey(soup)
+    
+    if refresh:
+        cyokyo_dict = previous["raw"].get("cyokyo") or {}
+    else:
+        urls.append(f"{CONFIG.KEIBABOOK_URL}/chihou/cyokyo/1/{race_id}")
+        with timeline.span("fetch.cyokyo", race_num):
+            html = _get(fetcher, urls[2], "cyokyo", on_page)
+        with timeline.span("parse.cyokyo", race_num), parsed(html, "cyokyo") as soup:
+            cyokyo_dict = parse_cyokyo(soup)
+    del html
+    
+    # B. Netkeiba情報 (タイム指数)
+    nk_url = get_netkeiba_speed_url(year, month, day, place_code, race_num)
+    nk_data = {}
+    if refresh:
+        # 出走取消の馬は出馬表から消えるため指数からも除く
+        nk_data = {u: v for u, v in (previous["raw"].get("speed") or {}).items() if not jockey_dict or u in jockey_dict}
+    elif nk_url:
+        urls.append(nk_url)
+        nk_data = scrape_netkeiba_speed_index(fetcher, nk_url, place_name, timeline, race_num, on_page)
+        # 近走指数を履歴ストアに蓄積 (ページに出る近5走より過去の分も参照できるように)
+        if speed_store is not None and nk_data:
+            with timeline.span("store.speed", race_num):
+                try:
+                    speed_store.append(race_id, nk_data)
+                except Exception as e:
+                    logger.warning(f"タイム指数の保存に失敗しました: {e}")
+    
+    # C. 指数の集計 (同条件・距離帯・近走加重・出走馬内順位を全馬まとめて計算)
+    scores = {}
+    if nk_data:
+        with timeline.span("analyze.speed", race_num):
+            condition = next(iter(nk_data.values())).get("condition", "")
+            scores = score_summary(score_field(nk_data, condition))
+    
+    with timeline.span("prompt", race_num):
+        if prompt_format == "verbose":
+            prompt = build_prompt(race_meta, danwa_dict, jockey_dict, cyokyo_dict, nk_data, scores)
+        else:
+            prompt = encode_compact(race_meta, danwa_dict, jockey_dict, cyokyo_dict, nk_data, scores, token_budget)
+    
+    race = {
+        "race_id": race_id,
+        "race_num": race_num,
+        "urls": urls,
+        "race_meta": race_meta,
+        "danwa": danwa_dict,
+        "jockey": jockey_dict,
+        "cyokyo": cyokyo_dict,
+        "speed": nk_data,
+        "scores": scores,
+        "prompt": prompt,
+        "prompt_format": prompt_format,
+        "prompt_tokens": estimate_tokens(prompt),
+    }
+    # D. 変更検知用の指紋 (リフレッシュ時は前回との差分も付ける)
+    race["snapshot"] = snapshot(race)
+    race["fingerprint"] = fingerprint(race["snapshot"])
+    race["changes"] = diff_snapshots(previous["snapshot"], race["snapshot"]) if refresh else None
+    return race
+
+def build_prompt(race_meta, danwa_dict, jockey_dict, cyokyo_dict, nk_data, scores=None):
+    """各馬のデータを結合してAI用プロンプトを作成 (データが無ければNone)"""
+    scores = scores or {}
+    # C. データ結合
+    merged_text = []
+    # 全馬番のリスト作成
+    all_uma = sorted(list(set(list(jockey_dict.keys()) + list(nk_data.keys()))), 
+                     key=lambda x: int(x) if x.isdigit() else 999)
+    
+    for uma in all_uma:
+        j = jockey_dict.get(uma, {"name": "不明", "is_change": False})
+        d = danwa_dict.get(uma, "（なし）")
+        c = cyokyo_dict.get(uma, "（なし）")
+        nk = nk_data.get(uma, {})
+        
+        sc = scores.get(uma, {})
+        condition = nk.get("condition", "不明")
+        
+        # スピード指数の強調表示 (同条件の実績がある馬のみ)
+        speed_txt = ""
+        if sc.get("same_n"):
+            speed_txt = (f"★【絶対スピード指数(同条件:{condition})】: "
+                         f"最高{fmt_index(sc['same_max'])} 平均{fmt_index(sc['same_mean'])} ({sc['same_n']}走)")
+        stats_txt = ""
+        if sc:
+            stats_txt = (f" 指数集計: 近走加重{fmt_index(sc['weighted'])} 距離帯最高{fmt_index(sc['band_max'])}"
+                         f" 近走最高{fmt_index(sc['best'])} 出走馬中{fmt_index(sc['rank'])}位/{len(scores)}頭\n")
+        
+        alert = "【⚠️乗り替わり】" if j["is_change"] else ""
+        
+        line = (
+            f"▼[馬番{uma}] {j['name']} {alert}\n"
+            f" {speed_txt}\n"
+            f"{stats_txt}"
+            f" 近5走指数: {nk.get('past', '-')}\n"
+            f" 談話: {d}\n"
+            f" 調教: {c}"
+        )
+        merged_text.append(line)
+
+    if not merged_text:
+        return None
+
+    # D. プロンプト作成
+    return (
+        f"レース名: {race_meta.get('race_name','')}\n"
+        f"条件: {race_meta.get('cond','')}\n\n"
+        "以下の各馬のデータ（騎手、タイム指数、談話、調教）から、推奨馬を分析してください。\n"
+        "特に「絶対スピード指数」が高い馬、および「乗り替わり」の有無を重視すること。\n\n"
+        + "\n".join(merged_text)
+    )
+
+def iter_prefetched(pool, func, items, depth, width=1):
+    """itemsを順番に (item, future) で返しつつ、後続を最大width件まで並行してpoolで処理する
+    (AI分析中も次レースの取得を続ける。取得済みで未処理の結果がdepth件を超えたら新たな取得を止め、保持データ量を制限)"""
+    items = iter(items)
+    pending = deque()
+    lock = threading.RLock() # 完了済みのfutureは add_done_callback がその場で呼ぶため再入可能にする
+    running, finished, taken = set(), set(), set() # 取得中 / 取得済みで未処理 / 取り出し済み
+    closed = threading.Event()
+
+    def on_done(future):
+        with lock:
+            running.discard(future)
+            if future not in taken: finished.add(future)
+            fill()
+
+    def fill():
+        while not closed.is_set() and len(running) < width and len(finished) <= depth:
+            item = next(items, pending)
+            if item is pending: return # 全件投入済み
+            try:
+                future = pool.submit(func, item)
+            except RuntimeError: # プールが終了済み (ジョブの中断時)
+                closed.set()
+                return
+            running.add(future)
+            pending.append((item, future))
+            future.add_done_callback(on_done)
+
+    try:
+        while True:
+            with lock:
+                fill()
+                if not pending: return
+                item, future = pending.popleft()
+                if future in finished:
+                    finished.discard(future)
+                else:
+                    taken.add(future)
+                fill()
+            yield item, future
+    finally:
+        closed.set()
+
+# ==================================================
+# 7. レースごとのAI分析・保存 (app.py のジョブと cli.py で共通)
+# ==================================================
+
+class RaceStores(NamedTuple):
+    """analyze_race が読み書きする保存先 (checkpoints は再開機能を使う場合のみ)"""
+    answer_cache: Any
+    snapshots: Any
+    supabase: Any
+    writer: Any
+    checkpoints: Any = None
+
+
+class Analysis(NamedTuple):
+    answer: str
+    reused: bool # 保存済みの回答を使った (Difyは呼んでいない)
+    stats: dict  # DifyClient.stream の計測値 (ttft, tokens_per_sec, error など)
+    failed: bool = False # エラー・空の回答 (どこにも保存していない)
+
+
+def analyze_race(race, stores: RaceStores, year, month, day, place_code, place_name, use_cache=True, previous=None,
+                 ab=False, timeline=NULL_TIMELINE, save_timings=False, on_start=None, on_chunk=None) -> Analysis:
+    """collect_race_data の結果をAI分析し、回答キャッシュ・スナップショット・履歴に保存する
+    use_cache: 入力データが前回と同一なら保存済みの回答を使う (Dify呼び出し・履歴保存を省略)
+    previous: リフレッシュ時の SnapshotStore.get の結果。指紋が同じなら前回の回答を使う
+              (空白の揺れなどプロンプトの文字列だけが変わった場合も再分析しない)
+    ab: 履歴にプロンプト形式も保存する / on_start: Dify呼び出しの直前、on_chunk: 回答の断片ごとに呼ぶ (表示用)"""
+    race_id, race_num, prompt = race["race_id"], race["race_num"], race["prompt"]
+    if use_cache:
+        cached = None
+        if previous and previous["fingerprint"] == race["fingerprint"]:
+            cached = previous["answer"]
+        if cached is None:
+            cached = lookup_cached_answer(prompt, stores.answer_cache, stores.supabase)
+        if cached is not None:
+            stores.snapshots.put(race, cached)
+            if stores.checkpoints:
+                stores.checkpoints.answered(race_id, cached)
+                stores.checkpoints.saved(race_id)
+            return Analysis(cached, True, {})
+
+    if on_start: on_start()
+    ai_start, cpu_start = time.perf_counter(), time.thread_time()
+    first_token = None
+    stats = {}
+    parts = []
+    for chunk in stream_dify_workflow(prompt, stats):
+        if first_token is None:
+            first_token = time.perf_counter()
+            timeline.add("ai.ttft", ai_start, first_token, race_num)
+        parts.append(chunk)
+        if on_chunk: on_chunk(chunk)
+    answer = "".join(parts)
+    timeline.add("ai.stream", ai_start, time.perf_counter(), race_num, chars=len(answer), attempts=stats.get("attempts"),
+                 cpu_seconds=round(time.thread_time() - cpu_start, 4))
+    # エラーで終わった回答は保存しない (キャッシュ・履歴・チェックポイントとも。次回の実行でやり直す)
+    if not is_cacheable_answer(answer, stats):
+        return Analysis(answer, False, stats, True)
+    stores.answer_cache.put(prompt_hash(prompt), race_id, answer)
+    stores.snapshots.put(race, answer)
+    if stores.checkpoints: stores.checkpoints.answered(race_id, answer)
+
+    # 保存 (バックグラウンドで一括upsert)
+    if stores.supabase:
+        with timeline.span("save", race_num):
+            save_history(race, answer, stores, year, month, day, place_code, place_name,
+                         timeline.for_race(race_num) if save_timings else None, ab)
+    if stores.checkpoints: stores.checkpoints.saved(race_id)
+    return Analysis(answer, False, stats)
+
+def save_history(race, answer, stores: RaceStores, year, month, day, place_code, place_name, timings=None, ab=False):
+    stores.writer.submit(history_record(year, place_code, place_name, month, day, f"{race['race_num']:02}",
+                                        race["race_id"], answer, race["prompt"], timings,
+                                        race["prompt_format"] if ab else None))
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# ==================================================
+# レースデータのスナップショット (変更検知・差分表示・再分析対象の判定)
+# ==================================================
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(".cache", "snapshots.sqlite3")
+
+# 指紋・差分の対象 (collect_race_data の戻り値のキー → 表示名)
+SECTIONS = {"jockey": "騎手", "danwa": "談話", "cyokyo": "調教", "speed": "指数"}
+
+
+def _normalize(value):
+    """空白の揺れ・指数の付帯情報を除いて比較用に正規化"""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, dict):
+        if "runs" in value: # タイム指数は近走の中身だけを比較
+            return [[r["course"], r["speed_index"], r.get("run_date", "")] for r in value["runs"]]
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def snapshot(race: dict) -> dict:
+    """collect_race_data の結果から保存・比較に使う部分を取り出す"""
+    return {key: {uma: _normalize(v) for uma, v in race.get(key, {}).items()} for key in SECTIONS}
+
+
+def fingerprint(snap: dict) -> str:
+    return hashlib.sha256(json.dumps(snap, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def diff_snapshots(old: dict, new: dict) -> list:
+    """項目・馬番ごとの変更点 (出走取消は変更後が「取消」)"""
+    rows = []
+    for key, label in SECTIONS.items():
+        before, after = old.get(key, {}), new.get(key, {})
+        for uma in sorted(set(before) | set(after), key=lambda x: int(x) if x.isdigit() else 999):
+            if before.get(uma) == after.get(uma): continue
+            rows.append({"項目": label, "馬番": uma, "変更前": _brief(key, before.get(uma), "（なし）"),
+                         "変更後": _brief(key, after.get(uma), "取消" if key == "jockey" else "（なし）")})
+    return rows
+
+
+def _brief(key, value, missing):
+    if value is None: return missing
+    if key == "jockey":
+        return value["name"] + (" (乗り替わり)" if value.get("is_change") else "")
+    if key == "speed":
+        return " / ".join(f"{course}({idx})" for course, idx, _ in value)
+    return str(value)
+
+
+class SnapshotStore:
+    """レースごとの最新スナップショットと、前回取得した調教・指数の生データを保存"""
+
+    def __init__(self, path: str = DEFAULT_SNAPSHOT_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " race_id TEXT PRIMARY KEY, fingerprint TEXT, data TEXT, updated_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, race_id: str) -> dict | None:
+        """{"fingerprint", "snapshot", "raw", "answer"} (raw はリフレッシュ時に再利用する cyokyo/speed、
+        answer はこのスナップショットに対するAI回答)"""
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint, data FROM snapshots WHERE race_id = ?", (race_id,)).fetchone()
+        if not row: return None
+        return {"fingerprint": row[0], "answer": None, **json.loads(row[1])}
+
+    def put(self, race: dict, answer: str | None = None):
+        snap = race.get("snapshot") or snapshot(race)
+        data = {"snapshot": snap, "raw": {k: race.get(k) for k in ("cyokyo", "speed")}, "answer": answer}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)",
+                (race["race_id"], fingerprint(snap), json.dumps(data, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
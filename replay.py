@@ -0,0 +1,143 @@
+"""アーカイブ済みページのバックテスト再解析 (オフライン・全コア並列)
+
+    python replay.py --from 2025-04-01 --to 2025-09-30 --out replay_out
+    python replay.py --prompts compact --token-budget 1800 --out replay_compact
+
+PageArchive に保存したHTMLを解析し直し、レース・談話・騎手・調教・近走指数の表を Parquet で出力する。
+--prompts を指定するとプロンプトも再生成する (抽出処理やプロンプト形式の変更を過去の開催で比較する用途)。
+ネットワークには一切アクセスしない。
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from cli import parse_date
+from page_archive import DEFAULT_ARCHIVE_PATH, PageArchive, read_day, latest_pages
+from parsers import (parsed, parse_race_info, parse_danwa_comments, parse_syutuba_jockey, parse_cyokyo,
+                     parse_speed_index, parse_course)
+from places import PLACE_NAMES
+from race_pipeline import build_prompt
+from prompt_encoder import DEFAULT_TOKEN_BUDGET, PROMPT_FORMATS, choose_format, encode_compact, estimate_tokens
+from speed_analytics import score_field, score_summary
+
+logger = logging.getLogger("nar.replay")
+
+TABLES = ("races", "danwa", "jockey", "cyokyo", "speed", "prompts")
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--from", dest="date_from", type=parse_date, default=None, help="開始日 (既定は最古の保存日)")
+    p.add_argument("--to", dest="date_to", type=parse_date, default=None, help="終了日 (既定は最新の保存日)")
+    p.add_argument("--archive", default=DEFAULT_ARCHIVE_PATH, help="PageArchive のディレクトリ")
+    p.add_argument("--out", default="replay_out", help="Parquetの出力先ディレクトリ")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="プロセス数 (既定は全コア)")
+    p.add_argument("--prompts", choices=PROMPT_FORMATS, default=None, help="プロンプトも再生成する形式")
+    p.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="1レースの入力トークン上限 (compact)")
+    return p
+
+# ==================================================
+# 1日分の再解析 (ワーカープロセスで実行)
+# ==================================================
+
+def replay_day(path: str, prompt_format: str | None = None, token_budget: int = DEFAULT_TOKEN_BUDGET) -> dict:
+    """1日分のアーカイブを解析し、表名 -> 行のリスト を返す"""
+    rows = {name: [] for name in TABLES}
+    pages = latest_pages(read_day(path))
+    day = os.path.basename(path)[:8]
+    for race_id in sorted({rid for rid, _ in pages}):
+        try:
+            replay_race(race_id, day, {page: r for (rid, page), r in pages.items() if rid == race_id},
+                        rows, prompt_format, token_budget)
+        except Exception as e:
+            rows["races"].append({"race_id": race_id, "date": day, "error": str(e)})
+    return rows
+
+
+def replay_race(race_id, day, pages, rows, prompt_format, token_budget):
+    """collect_race_data と同じ抽出を保存済みHTMLに対して行う (取得できていないページは空扱い)"""
+    any_page = next(iter(pages.values()))
+    place_code = any_page["place_code"]
+    place_name = PLACE_NAMES.get(place_code, "")
+    race_meta, danwa, jockey, cyokyo, speed = {}, {}, {}, {}, {}
+    if "danwa" in pages:
+        with parsed(pages["danwa"]["html"], "danwa") as soup:
+            race_meta = parse_race_info(soup)
+            danwa = parse_danwa_comments(soup)
+    if "syutuba" in pages:
+        with parsed(pages["syutuba"]["html"], "syutuba") as soup:
+            jockey = parse_syutuba_jockey(soup)
+    if "cyokyo" in pages:
+        with parsed(pages["cyokyo"]["html"], "cyokyo") as soup:
+            cyokyo = parse_cyokyo(soup)
+    if "speed" in pages:
+        with parsed(pages["speed"]["html"], "speed") as soup:
+            speed = parse_speed_index(soup, place_name)
+
+    rows["races"].append({"race_id": race_id, "date": day, "place_code": place_code, "race_num": int(race_id[10:12]),
+                          "race_name": race_meta.get("race_name", ""), "cond": race_meta.get("cond", ""),
+                          "pages": ",".join(sorted(pages)), "fetched_at": max(r["fetched_at"] for r in pages.values()),
+                          "error": None})
+    rows["danwa"] += [{"race_id": race_id, "umaban": u, "comment": c} for u, c in danwa.items()]
+    rows["jockey"] += [{"race_id": race_id, "umaban": u, "jockey": j["name"], "is_change": j["is_change"]}
+                       for u, j in jockey.items()]
+    rows["cyokyo"] += [{"race_id": race_id, "umaban": u, "text": t} for u, t in cyokyo.items()]
+    for u, info in speed.items():
+        rows["speed"] += [{"race_id": race_id, "umaban": u, "horse": info.get("horse"), "condition": info["condition"],
+                           "run_no": run["run_no"], "run_date": run["run_date"], "course": run["course"],
+                           **parse_course(run["course"]), "speed_index": run["speed_index"]}
+                          for run in info.get("runs", [])]
+
+    if prompt_format and (jockey or speed):
+        fmt = choose_format(race_id, prompt_format)
+        scores = {}
+        if speed:
+            scores = score_summary(score_field(speed, next(iter(speed.values())).get("condition", "")))
+        if fmt == "verbose":
+            prompt = build_prompt(race_meta, danwa, jockey, cyokyo, speed, scores)
+        else:
+            prompt = encode_compact(race_meta, danwa, jockey, cyokyo, speed, scores, token_budget)
+        rows["prompts"].append({"race_id": race_id, "prompt_format": fmt, "prompt_tokens": estimate_tokens(prompt),
+                                "prompt": prompt})
+
+# ==================================================
+# 実行
+# ==================================================
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    archive = PageArchive(args.archive)
+    days = archive.days(args.date_from and f"{args.date_from:%Y%m%d}", args.date_to and f"{args.date_to:%Y%m%d}")
+    if not days:
+        logger.error(f"アーカイブがありません: {args.archive}")
+        return 1
+    logger.info(f"{len(days)} 日分を {args.workers} プロセスで再解析します ({archive.total_bytes() / 1024 / 1024:.1f} MB)")
+
+    start = time.perf_counter()
+    tables = {name: [] for name in TABLES}
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(replay_day, archive.file_of(d), args.prompts, args.token_budget): d for d in days}
+        for i, future in enumerate(as_completed(futures), 1):
+            for name, rows in future.result().items():
+                tables[name] += rows
+            logger.info(f"[{i}/{len(days)}] {futures[future]} 完了")
+
+    os.makedirs(args.out, exist_ok=True)
+    for name, rows in tables.items():
+        if not rows: continue
+        df = pd.DataFrame(rows)
+        df.to_parquet(os.path.join(args.out, f"{name}.parquet"), index=False)
+        logger.info(f"{name}: {len(df)} 行")
+    failed = sum(1 for r in tables["races"] if r.get("error"))
+    logger.info(f"完了: {len(tables['races'])} レース (エラー {failed}) / {time.perf_counter() - start:.1f} 秒 → {args.out}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
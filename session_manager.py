@@ -0,0 +1,180 @@
+import threading
+import time
+from typing import Callable, NamedTuple
+from urllib.parse import urlsplit
+
+from requests.cookies import RequestsCookieJar
+
+from lean_browser import SavingsEstimator, page_network_stats
+
+# ==================================================
+# ログインセッション管理 (Streamlitの再実行をまたいでCookie/ブラウザを再利用)
+# ==================================================
+
+class SiteLogin(NamedTuple):
+    name: str
+    login: Callable          # login(driver, waiter) -> bool
+    check_url: str           # ログイン状態確認用のページ
+    domain: str              # Cookieのドメイン (例: "netkeiba.com")
+    marker: str | None = "logout" # ログイン中のページに含まれる文字列 (Noneなら確認せずCookieの有無で判定)
+    enabled: bool = True     # ID/PASS未設定ならFalse (ブラウザを起動しない)
+    pages: tuple = ()        # ログインが必要なページ種別 (準備完了マーカーが無ければログイン切れを疑う)
+
+
+class SessionManager:
+    """ログイン済みCookieを保持し、期限切れのサイトだけ再ログインする"""
+
+    def __init__(self, driver_factory, sites, keep_browser: bool = False,
+                 max_navigations: int = 40, max_browser_mb: float = 700, health_ttl: float = 300,
+                 relogin_interval: float = 300, lean: bool = True, savings: SavingsEstimator | None = None):
+        self.driver_factory = driver_factory
+        # lean: driver_factory が軽量モードのブラウザを返すか (通常モードのログインは節約量の基準として記録)
+        self.lean = lean
+        self.savings = savings or SavingsEstimator()
+        self.sites = sites
+        self.keep_browser = keep_browser
+        self.max_navigations = max_navigations
+        self.max_browser_mb = max_browser_mb
+        self.health_ttl = health_ttl
+        self.relogin_interval = relogin_interval
+        self.cookies = RequestsCookieJar()
+        self.logins = 0
+        self.page_stats = []  # ログイン時の通信量 (サイトごと、bytes_saved は通常モードとの差の見積もり)
+        self._driver = None
+        self._navigations = 0
+        self._invalid = set()
+        self._checked_at = {}
+        self._logged_in_at = {}
+        self._lock = threading.Lock()
+
+    def ensure_logged_in(self, fetcher, waiter) -> dict:
+        """fetcherへ保持中のCookieを渡し、必要なサイトだけ再ログインする"""
+        status = {}
+        with self._lock:
+            fetcher.session.cookies.update(self.cookies)
+            for site in self.sites:
+                if not site.enabled:
+                    status[site.name] = False
+                    continue
+                if self._is_healthy(site, fetcher):
+                    status[site.name] = True
+                    continue
+                driver = self._browser()
+                ok = site.login(driver, waiter)
+                self._navigations += 2
+                stats = self.savings.annotate(site.name, page_network_stats(driver), self.lean)
+                if stats:
+                    self.page_stats.append({"site": site.name, "ok": ok, **stats})
+                if ok:
+                    self._invalid.discard(site.name)
+                    fetcher.import_cookies(driver)
+                    self.cookies.update(fetcher.session.cookies)
+                    self._checked_at[site.name] = self._logged_in_at[site.name] = time.monotonic()
+                    self.logins += 1
+                status[site.name] = ok
+            self._release_browser()
+        return status
+
+    def invalidate(self, name: str | None = None):
+        """次回の確認を強制 (ログイン切れが疑われる場合)"""
+        with self._lock:
+            if name:
+                self._checked_at.pop(name, None)
+                self._invalid.add(name)
+            else:
+                self._checked_at.clear()
+                self._invalid.update(s.name for s in self.sites)
+
+    def recover(self, fetcher, waiter, missing_pages) -> bool:
+        """ログインが必要なページにマーカーが無かった場合、そのサイトに再ログインする
+        (未公開ページで毎回ブラウザを起動しないよう、前回のログインから relogin_interval 秒以内は行わない)
+        再ログインしたらTrue (呼び出し側でページを取り直す)"""
+        now = time.monotonic()
+        suspects = [s.name for s in self.sites if s.enabled and set(s.pages) & set(missing_pages)
+                    and now - self._logged_in_at.get(s.name, float("-inf")) >= self.relogin_interval]
+        if not suspects: return False
+        for name in suspects:
+            self.invalidate(name)
+        logins = self.logins
+        status = self.ensure_logged_in(fetcher, waiter)
+        return self.logins > logins and any(status.get(name) for name in suspects)
+
+    def browser_mb(self) -> float:
+        """常駐中のブラウザ (chromedriver + Chrome) の合計RSS (未起動なら0)"""
+        driver = self._driver
+        return browser_rss_mb(driver) if driver is not None else 0.0
+
+    def recycle(self) -> bool:
+        """常駐ブラウザを破棄 (Cookieは保持するため、次回はログイン切れのサイトだけ再ログイン)
+        ログイン処理中は待たずにFalseを返す"""
+        if not self._lock.acquire(blocking=False): return False
+        try:
+            if self._driver is None: return False
+            self._quit()
+            return True
+        finally:
+            self._lock.release()
+
+    def close(self):
+        with self._lock:
+            self._quit()
+
+    # ---------- 内部処理 ----------
+
+    def _is_healthy(self, site, fetcher) -> bool:
+        if site.name in self._invalid: return False
+        checked = self._checked_at.get(site.name)
+        if checked is not None and time.monotonic() - checked < self.health_ttl:
+            return True
+        if not any((c.domain or "").endswith(site.domain) for c in self.cookies):
+            return False
+        if site.marker is None: return True # ページからは判定できないサイト (ログインが必要なページの取得結果で判定)
+        try:
+            res = fetcher.session.get(site.check_url, timeout=fetcher.timeout)
+            healthy = res.ok and site.marker in res.text
+        except Exception:
+            healthy = False
+        if healthy:
+            self._checked_at[site.name] = time.monotonic()
+        else:
+            self._checked_at.pop(site.name, None)
+        return healthy
+
+    def _browser(self):
+        if self._driver is None:
+            self._driver = self.driver_factory()
+            self._navigations = 0
+        return self._driver
+
+    def _release_browser(self):
+        """常駐しない設定、またはN回遷移/メモリ上限超過でブラウザを破棄"""
+        if self._driver is None: return
+        if (not self.keep_browser or self._navigations >= self.max_navigations
+                or browser_rss_mb(self._driver) >= self.max_browser_mb):
+            self._quit()
+
+    def _quit(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            finally:
+                self._driver = None
+
+
+def cookie_domain(base_url: str) -> str:
+    """ログインCookieのドメイン (例: https://s.keibabook.co.jp -> keibabook.co.jp)"""
+    host = urlsplit(base_url).hostname or ""
+    if host.replace(".", "").isdigit() or host.count(".") < 2:
+        return host
+    return host.split(".", 1)[1]
+
+
+def browser_rss_mb(driver) -> float:
+    """chromedriverとその子プロセス(Chrome)の合計RSS (psutilが無ければ0)"""
+    try:
+        import psutil
+        proc = psutil.Process(driver.service.process.pid)
+        procs = [proc] + proc.children(recursive=True)
+        return sum(p.memory_info().rss for p in procs) / 1024 / 1024
+    except Exception:
+        return 0.0
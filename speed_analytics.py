@@ -0,0 +1,63 @@
+import pandas as pd
+
+from parsers import parse_course
+
+# ==================================================
+# タイム指数の集計 (出走馬×近走のDataFrameを一括計算)
+# ==================================================
+
+RECENCY_DECAY = 0.8  # 近走加重: 前走1.0, 2走前0.8, 3走前0.64 ...
+DISTANCE_BAND = 200  # 距離帯: 同じ馬場で ±200m 以内
+
+RUN_COLUMNS = ["umaban", "run_no", "course", "speed_index"]
+SCORE_COLUMNS = ["same_max", "same_mean", "same_n", "band_max", "weighted", "best", "rank"]
+_COURSE_RE = r'(?P<venue>\D*?)(?P<surface>芝|ダ|障)(?P<distance>\d{3,4})'
+
+
+def runs_frame(speed_data: dict) -> pd.DataFrame:
+    """parse_speed_index の結果を 馬番×近走 の1行1走に展開し、コースを 競馬場・馬場・距離 に分解"""
+    rows = [(uma, run["run_no"], run["course"], run["speed_index"])
+            for uma, info in speed_data.items() for run in info.get("runs", [])]
+    df = pd.DataFrame(rows, columns=RUN_COLUMNS)
+    course = df["course"].str.extract(_COURSE_RE)
+    df["venue"] = course["venue"].str.strip()
+    df["surface"] = course["surface"]
+    df["distance"] = pd.to_numeric(course["distance"])
+    return df
+
+
+def score_field(speed_data: dict, condition: str) -> pd.DataFrame:
+    """全出走馬の指数を一括集計 (index=馬番)
+
+    same_*: 同条件 (競馬場・馬場・距離が一致) の最高/平均/走数
+    band_max: 同じ馬場・距離帯の最高 / weighted: 近走加重平均 / best: 近走最高
+    rank: weighted の出走馬内順位 (1が最上位)
+    """
+    df = runs_frame(speed_data)
+    target = parse_course(condition)
+    if df.empty:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+
+    idx = df["speed_index"].astype(float)
+    same = ((df["venue"] == target["venue"]) & (df["surface"] == target["surface"])
+            & (df["distance"] == target["distance"]))
+    band = (df["surface"] == target["surface"]) & ((df["distance"] - (target["distance"] or 0)).abs() <= DISTANCE_BAND)
+    weight = RECENCY_DECAY ** df["run_no"]
+    by = df["umaban"]
+
+    scores = pd.DataFrame({
+        "same_max": idx.where(same).groupby(by).max(),
+        "same_mean": idx.where(same).groupby(by).mean(),
+        "same_n": same.groupby(by).sum(),
+        "band_max": idx.where(band).groupby(by).max(),
+        "weighted": (idx * weight).groupby(by).sum() / weight.groupby(by).sum(),
+        "best": idx.groupby(by).max(),
+    })
+    scores["rank"] = scores["weighted"].rank(ascending=False, method="min")
+    return scores.round(1)
+
+
+def score_summary(scores: pd.DataFrame) -> dict:
+    """プロンプト用に馬番ごとの数値を辞書化 (欠損はNone)"""
+    scores = scores.astype(object).where(scores.notna(), None)
+    return {uma: row for uma, row in scores.to_dict("index").items()}
@@ -0,0 +1,104 @@
+import glob
+import os
+import threading
+import time
+
+import pandas as pd
+
+from parsers import parse_course
+
+# ==================================================
+# タイム指数の近走履歴ストア (Parquet・追記のみ・重複除去)
+# ==================================================
+
+DEFAULT_SPEED_STORE_PATH = os.path.join(".cache", "speed_runs")
+
+SPEED_COLUMNS = ["horse", "run_date", "course", "venue", "surface", "distance", "speed_index", "race_id", "scraped_at"]
+# 同じ近走は後続レースのページにも出てくるため、馬・日付・コース・指数で同一とみなす
+KEY_COLUMNS = ["horse", "run_date", "course", "speed_index"]
+_DTYPES = {"distance": "Int64", "speed_index": "Int64", "scraped_at": "float64"}
+
+
+def speed_rows(race_id: str, speed_data: dict) -> list:
+    """parse_speed_index の結果を1走1行に展開"""
+    now = time.time()
+    rows = []
+    for info in speed_data.values():
+        horse = info.get("horse")
+        if not horse: continue
+        for run in info.get("runs", []):
+            rows.append({"horse": horse, "run_date": run.get("run_date", ""), "course": run["course"],
+                         **parse_course(run["course"]), "speed_index": run["speed_index"],
+                         "race_id": race_id, "scraped_at": now})
+    return rows
+
+
+class SpeedStore:
+    """スクレイピングした近走を小さなParquetファイルとして追記し、溜まったら1ファイルに統合する"""
+
+    def __init__(self, path: str = DEFAULT_SPEED_STORE_PATH, compact_every: int = 32):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._keys = None # 既存キー (初回追記時に読み込む)
+
+    def append(self, race_id: str, speed_data: dict) -> int:
+        """未保存の近走だけを書き込み、追加件数を返す"""
+        rows = speed_rows(race_id, speed_data)
+        if not rows: return 0
+        with self._lock:
+            keys = self._load_keys()
+            new = []
+            for r in rows:
+                key = tuple(r[k] for k in KEY_COLUMNS)
+                if key in keys: continue
+                keys.add(key)
+                new.append(r)
+            if not new: return 0
+            df = pd.DataFrame(new, columns=SPEED_COLUMNS).astype(_DTYPES)
+            df.to_parquet(os.path.join(self.path, f"part-{time.time_ns()}.parquet"), index=False)
+            if len(self._parts()) >= self.compact_every:
+                self._compact()
+        return len(new)
+
+    def history(self, horse: str, columns=("run_date", "course", "speed_index")) -> pd.DataFrame:
+        """1頭の全近走 (必要な列だけ読み込み、馬名で絞り込み)"""
+        return self.histories([horse], columns)
+
+    def histories(self, horses, columns=("run_date", "course", "speed_index")) -> pd.DataFrame:
+        """複数頭の近走をまとめて取得 (horse列付き)"""
+        cols = ["horse"] + [c for c in columns if c != "horse"]
+        with self._lock: # 統合中のファイル削除と競合しないように
+            if not self._parts():
+                return pd.DataFrame(columns=cols)
+            df = pd.read_parquet(self.path, columns=cols, filters=[("horse", "in", list(horses))])
+        return df.sort_values(["horse", "run_date"], kind="stable", ignore_index=True)
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    # ---------- 内部処理 ----------
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, "part-*.parquet")))
+
+    def _load_keys(self):
+        if self._keys is None:
+            self._keys = set()
+            if self._parts():
+                df = pd.read_parquet(self.path, columns=KEY_COLUMNS)
+                self._keys = set(df.astype(object).itertuples(index=False, name=None))
+        return self._keys
+
+    def _compact(self):
+        """全パートを馬名順の1ファイルにまとめる (馬名での絞り込みが行グループ単位で効く)"""
+        parts = self._parts()
+        if len(parts) < 2: return
+        df = pd.read_parquet(self.path).drop_duplicates(KEY_COLUMNS).sort_values(["horse", "run_date"], kind="stable")
+        tmp = os.path.join(self.path, f".compact-{time.time_ns()}.tmp") # 先頭"."は読み込み対象外
+        df.to_parquet(tmp, index=False, row_group_size=20000)
+        os.replace(tmp, os.path.join(self.path, f"part-{time.time_ns()}.parquet"))
+        for p in parts:
+            os.remove(p)
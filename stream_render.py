@@ -0,0 +1,49 @@
+import time
+
+# ==================================================
+# ストリーミング表示の間引き (チャンクをまとめて一定間隔で描画)
+# ==================================================
+
+
+class ThrottledRenderer:
+    """placeholder.markdown の呼び出しを最大 1/interval 回/秒 (または max_chars 文字ごと) に制限する"""
+
+    def __init__(self, placeholder, interval: float = 0.15, max_chars: int = 400, cursor: str = "▌"):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.max_chars = max_chars
+        self.cursor = cursor
+        self.renders = 0
+        self._parts = []
+        self._pending = 0
+        self._last = 0.0
+
+    def write(self, chunk: str):
+        if not chunk: return
+        self._parts.append(chunk)
+        self._pending += len(chunk)
+        now = time.monotonic()
+        if now - self._last >= self.interval or self._pending >= self.max_chars:
+            self._render(self.cursor, now)
+
+    def flush_if_due(self):
+        """間引きで描画を保留している分を、interval を過ぎていれば描画 (ストリームが途切れても最後の断片を表示)"""
+        if self._pending and time.monotonic() - self._last >= self.interval:
+            self._render(self.cursor, time.monotonic())
+
+    def text(self) -> str:
+        # 文字列の += を避け、描画時にだけ結合する
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def close(self) -> str:
+        """最後にカーソル無しで確定描画し、全文を返す"""
+        self._render("", time.monotonic())
+        return self.text()
+
+    def _render(self, suffix, now):
+        self.placeholder.markdown(self.text() + suffix)
+        self.renders += 1
+        self._pending = 0
+        self._last = now
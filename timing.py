@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# ==================================================
+# 処理時間計測 (ステージごとのスパンを記録)
+# ==================================================
+
+
+class Timeline:
+    """1回の実行で発生したスパン (ステージ名・レース番号・開始/終了) を記録する
+    span() で計測した区間には、そのスレッドが消費したCPU時間 (cpu_seconds) も付ける"""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str, race: int | None = None, **attrs):
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(stage, start, time.perf_counter(), race,
+                     cpu_seconds=round(time.thread_time() - cpu_start, 4), **attrs)
+
+    def add(self, stage: str, start: float, end: float, race: int | None = None, **attrs):
+        """perf_counter基準の開始・終了時刻でスパンを追加 (TTFTなど外で測った区間用)"""
+        record = {
+            "stage": stage,
+            "race": race,
+            "start": round(start - self.t0, 4),
+            "end": round(end - self.t0, 4),
+            "seconds": round(end - start, 4),
+            "thread": threading.current_thread().name,
+            **attrs,
+        }
+        with self._lock:
+            self.spans.append(record)
+
+    def for_race(self, race: int) -> list:
+        with self._lock:
+            return [s for s in self.spans if s["race"] == race]
+
+    def totals(self) -> dict:
+        """ステージごとの合計秒数"""
+        result = {}
+        with self._lock:
+            for s in self.spans:
+                result[s["stage"]] = round(result.get(s["stage"], 0) + s["seconds"], 4)
+        return result
+
+    def cpu_by_race(self) -> dict:
+        """レース番号ごとのCPU秒数の合計 (cpu_seconds を持つスパンのみ)"""
+        result = {}
+        with self._lock:
+            for s in self.spans:
+                if s["race"] is None or s.get("cpu_seconds") is None: continue
+                result[s["race"]] = round(result.get(s["race"], 0) + s["cpu_seconds"], 4)
+        return result
+
+    def to_jsonl(self) -> str:
+        with self._lock:
+            return "\n".join(json.dumps(s, ensure_ascii=False) for s in self.spans)
+
+
+class NullTimeline(Timeline):
+    """計測しない場合のダミー"""
+
+    def add(self, *args, **kwargs):
+        pass
+
+
+NULL_TIMELINE = NullTimeline()